@@ -0,0 +1,145 @@
+""" Automatic responses to keywords in channel messages (e.g., "I LOVE"), as
+configured in the [Autorespond:<name>] sections of the config file """
+
+import logging
+import random
+import re
+import time
+
+
+SECTION_PREFIX = "Autorespond:"
+
+
+class AutoResponseRule:
+    """ A trigger rule: responds with one of responses if the message contains
+    one of keywords (case insensitive) or matches regex. channels limits the
+    rule to these channel names; a rule without keywords and regex matches
+    every message in its channels. A rule fires at most once per cooldown
+    seconds per channel. """
+
+    def __init__(self, name, responses, keywords=None, regex=None, channels=None, cooldown=0):
+        self.name = name
+        self.responses = list(responses)
+        self.keywords = list(keywords) if keywords else []
+        self.regex = regex
+        self.channels = set(channels) if channels else None # None: all channels
+        self.cooldown = cooldown
+
+        if len(self.responses) == 0:
+            raise ValueError("Autorespond rule '{}' has no responses".format(name))
+        if self.regex:
+            try:
+                re.compile(self.regex)
+            except re.error as e:
+                raise ValueError("Autorespond rule '{}' has an invalid regex: {}".format(name, e))
+
+    def pattern(self):
+        """ returns the regular expression of this rule, or None if it matches every message """
+        parts = [re.escape(keyword) for keyword in self.keywords]
+        if self.regex:
+            parts.append("(?:" + self.regex + ")")
+        if len(parts) == 0:
+            return None
+        return "|".join(parts)
+
+    def applies_to(self, channel_name):
+        return self.channels is None or channel_name in self.channels
+
+
+def load_rules(config):
+    """ reads all [Autorespond:<name>] sections of a configparser.ConfigParser,
+    in the order they appear in the config files """
+    rules = []
+    for section in config.sections():
+        if not section.startswith(SECTION_PREFIX):
+            continue
+
+        def get_list(option, separator):
+            value = config.get(section, option, fallback="")
+            return [part.strip() for part in value.split(separator) if part.strip() != ""]
+
+        rules.append(AutoResponseRule(section[len(SECTION_PREFIX):],
+                                      get_list('responses', "\n"),
+                                      keywords=get_list('keywords', ","),
+                                      regex=config.get(section, 'regex', fallback=None),
+                                      channels=get_list('channels', ","),
+                                      cooldown=config.getfloat(section, 'cooldown', fallback=0)))
+    return rules
+
+
+class AutoResponder:
+    """ Compiles the patterns of the rules which apply to a channel into one
+    regular expression (one named group per rule), so a message is scanned
+    once no matter how many rules there are. If several rules match, the first
+    rule (in config order) which is not cooling down wins. """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.last_fired = {} # (rule index, channel name) -> time
+
+        # rules without a pattern respond to every message in their channels
+        self.catch_all = {} # channel name -> rule index
+        self.patterns = {} # rule index -> compiled pattern of the rule
+        for idx, rule in enumerate(self.rules):
+            pattern = rule.pattern()
+            if pattern is None:
+                if rule.channels is None:
+                    raise ValueError("Autorespond rule '{}' needs keywords, a regex or channels".format(rule.name))
+                for channel_name in rule.channels:
+                    self.catch_all.setdefault(channel_name, idx)
+            else:
+                self.patterns[idx] = re.compile(pattern, re.IGNORECASE)
+
+        self.matchers = {} # channel name -> combined pattern of the rules for that channel
+        logging.info("AutoResponder: compiled %d rules", len(self.rules))
+
+    def is_catch_all_channel(self, channel_name):
+        """ True if every message in this channel gets a response (even commands) """
+        return channel_name in self.catch_all
+
+    def get_matcher(self, channel_name):
+        """ returns the combined pattern of the rules which apply to a channel
+        (compiled on first use), or None if there are no such rules """
+        if channel_name not in self.matchers:
+            patterns = ["(?P<r{}>{})".format(idx, self.rules[idx].pattern())
+                        for idx in sorted(self.patterns.keys()) if self.rules[idx].applies_to(channel_name)]
+            self.matchers[channel_name] = re.compile("|".join(patterns), re.IGNORECASE) if len(patterns) > 0 else None
+        return self.matchers[channel_name]
+
+    def matching_rules(self, channel_name, text):
+        """ yields the indices of the rules for this channel which match text, in config order """
+        if channel_name in self.catch_all:
+            yield self.catch_all[channel_name]
+            return
+        matcher = self.get_matcher(channel_name)
+        if matcher is None:
+            return
+
+        matched = set()
+        for match in matcher.finditer(text):
+            matched.add(int(match.lastgroup[1:]))
+        if len(matched) == 0:
+            return
+
+        # finditer only returns non-overlapping matches, so a match can hide an
+        # overlapping match of another rule ("I LOVE" hides "LOVE"): the rules
+        # which were not found are checked on their own
+        for idx in sorted(self.patterns.keys()):
+            rule = self.rules[idx]
+            if idx in matched or (rule.applies_to(channel_name) and self.patterns[idx].search(text)):
+                yield idx
+
+    def get_response(self, channel_name, text):
+        """ returns the response to a message, or None """
+        now = time.time()
+        for idx in self.matching_rules(channel_name, text):
+            rule = self.rules[idx]
+            key = (idx, channel_name)
+            if now - self.last_fired.get(key, 0) < rule.cooldown:
+                logging.debug("AutoResponder: rule '%s' is cooling down in %s", rule.name, channel_name)
+                continue
+
+            self.last_fired[key] = now
+            return random.choice(rule.responses)
+
+        return None
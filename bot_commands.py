@@ -3,18 +3,59 @@
 import logging
 import asyncio
 from datetime import datetime
-import json
-import urllib
-import urllib.request
-import urllib.parse
 
 from model import MyDBModel
+from http_client import HTTPClientError
+
 import random
-import sys, inspect
-import discord
+import functools
 import traceback
 
 
+# command classes in the order they are defined, filled by @bot_command
+COMMAND_REGISTRY = []
+
+
+def bot_command(cmd, aliases=()):
+    """ class decorator that registers a bot command class for cmd (and its aliases) """
+    def register(cls):
+        cls.cmd = cmd
+        cls.aliases = list(aliases)
+        COMMAND_REGISTRY.append(cls)
+        return cls
+    return register
+
+
+def format_metrics(metrics):
+    """ returns a metrics dictionary as one line, e.g., "hits=3, misses=1" """
+    return ", ".join(["{}={}".format(key, metrics[key]) for key in sorted(metrics.keys())])
+
+
+class LazyCommand:
+    """ Stands in for a bot command object, which is only created when the
+    command is used for the first time """
+
+    def __init__(self, cls, db_model, discord_client):
+        self.cls = cls
+        self.cmd = cls.cmd
+        self.model = db_model
+        self.client = discord_client
+        self.command = None
+
+    def get_command(self):
+        if self.command is None:
+            logging.info("Creating command object for '%s'", self.cmd)
+            self.command = self.cls(self.model, self.client)
+        return self.command
+
+    @asyncio.coroutine
+    def handle_command(self, message, cmd, params):
+        yield from self.get_command().handle_command(message, cmd, params)
+
+    def __repr__(self):
+        return "<LazyCommand {}>".format(self.cls.__name__)
+
+
 class AbstractBotCommand:
     available_commands = {}
 
@@ -27,11 +68,12 @@ class AbstractBotCommand:
     @staticmethod
     def import_bot_commands(db_model, discord_client):
         """ initializes all bot commands """
-        for name, obj in inspect.getmembers(sys.modules[__name__]):
-            if inspect.isclass(obj) and "AbstractBotCommand" not in str(obj.__name__ ) and "bot_commands" in str(obj.__module__):
-                newobj = obj.__new__(obj)
-                newobj.__init__(db_model, discord_client)
-                AbstractBotCommand.register_command(newobj.cmd, newobj)
+        for cls in COMMAND_REGISTRY:
+            command = LazyCommand(cls, db_model, discord_client)
+            AbstractBotCommand.register_command(cls.cmd, command)
+            # commands can have alternative names
+            for alias in cls.aliases:
+                AbstractBotCommand.register_command(alias, command)
 
 
     @staticmethod
@@ -40,39 +82,23 @@ class AbstractBotCommand:
         AbstractBotCommand.available_commands[cmd] = object
 
     @staticmethod
-    @asyncio.coroutine
-    def handle_msg(message):
-        """ parses the msg and dispatches it to the right sub-command """
-
-        msg = str(message.content)
-
-
-        if not msg.startswith("!"):
-            return
-
-        if " " in msg:
-            cmd =  msg[msg.find("!"):msg.find(" ")]
-            # extract params
-            params = msg[msg.find(" ")+1:]
-        else: # new line at the end, so we are fine
-            cmd =  msg[msg.find("!"):]
-            params = ""
-        # extract command name
-        logging.info("Found command string '%s'", cmd)
-
-        # see if this command is available
-        if cmd in AbstractBotCommand.available_commands:
-            try:
-                # dispatch command to abstract command
-                yield from AbstractBotCommand.available_commands[cmd].handle_command(message, cmd, params)
-            except Exception as e:
-                logging.exception("Unexpected error while dispatching...")
-                logging.error(traceback.format_exc())
-                yield from AbstractBotCommand.available_commands[cmd].client.send_to_debug_channel(
-                    "Unexpected error while dispatching '{}': {}".format(cmd, traceback.format_exc()))
-        else:
-            logging.info("Command '%s' not found...", cmd)
+    def add_routes(router):
+        """ adds all available commands to a router.CommandRouter """
+        for cmd, command in AbstractBotCommand.available_commands.items():
+            router.add(cmd, functools.partial(AbstractBotCommand.dispatch_command, command))
 
+    @staticmethod
+    @asyncio.coroutine
+    def dispatch_command(command, message, cmd, params):
+        """ runs a command, errors are reported to the debug channel """
+        try:
+            # dispatch command to abstract command
+            yield from command.handle_command(message, cmd, params)
+        except Exception as e:
+            logging.exception("Unexpected error while dispatching...")
+            logging.error(traceback.format_exc())
+            yield from command.client.send_to_debug_channel(
+                "Unexpected error while dispatching '{}': {}".format(cmd, traceback.format_exc()), urgent=True)
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
@@ -81,11 +107,11 @@ class AbstractBotCommand:
 
 
 
+@bot_command("!whois")
 class WhoisBotCommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!whois"
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
@@ -99,7 +125,7 @@ class WhoisBotCommand:
 
             print("wanted_id=" + str(wanted_member_id))
             if wanted_member_id in self.client.authed_users:
-                char_data = self.model.get_discord_members_character_id(wanted_member_id)
+                char_data = yield from self.model.get_discord_members_character_id(wanted_member_id)
 
                 combined_message = "<@%(author_id)s> is authed as %(char_name)s (%(corp_name)s)" % \
                                    {
@@ -117,18 +143,18 @@ class WhoisBotCommand:
 
 
 
+@bot_command("!whoami")
 class WhoamiBotCommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!whoami"
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
         logging.info("in WhoamiBotCommand.handle_command()")
 
         if message.author.id in self.client.authed_users:
-            char_data = self.model.get_discord_members_character_id(message.author.id)
+            char_data = yield from self.model.get_discord_members_character_id(message.author.id)
             combined_message = "<@%(author_id)s> is authed as %(char_name)s (%(corp_name)s)" % \
                                {
                                    'author_id': message.author.id,
@@ -141,46 +167,60 @@ class WhoamiBotCommand:
             yield from self.client.send_message(message.channel, "<@" + str(message.author.id) + "> I am sorry, I do not know you!")
 
 
+@bot_command("!chuck")
 class ChuckBotCommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!chuck"
+        self.url = "http://api.icndb.com/jokes/random"
+
+    @asyncio.coroutine
+    def fetch_joke(self):
+        data = yield from self.client.http_client.get_json(self.url)
+        try:
+            return data['value']['joke']
+        except (KeyError, TypeError):
+            raise HTTPClientError("Unexpected response from icndb: " + str(data))
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
         logging.info("in ChuckBotCommand.handle_command()")
-        # query http://thecatapi.com/api/images/get?format=src&type=gif
-        response = urllib.request.urlopen("http://api.icndb.com/jokes/random")
-        response = str(response.read().decode())
-        data = json.loads(response)
-
-        joke = data['value']['joke']
+        try:
+            # jokes are prefetched, see PrefetchPool
+            joke = yield from self.client.joke_pool.get(self.fetch_joke)
+        except HTTPClientError:
+            logging.exception("Could not get a joke")
+            joke = "Chuck Norris does not need jokes. (Could not reach icndb.com, try again later)"
 
         yield from self.client.send_message(message.channel, joke)
 
 
 
 
+@bot_command("!cat")
 class CatBotCommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!cat"
+        self.url = "http://thecatapi.com/api/images/get?format=src&type=gif"
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
         logging.info("in CatBotCommand.handle_command()")
-        # query http://thecatapi.com/api/images/get?format=src&type=gif
-        response = urllib.request.urlopen("http://thecatapi.com/api/images/get?format=src&type=gif")
-        yield from self.client.send_message(message.channel, response.url)
+        # thecatapi redirects to a random cat gif, which are prefetched (see PrefetchPool)
+        try:
+            cat_url = yield from self.client.cat_pool.get(functools.partial(self.client.http_client.get_final_url, self.url))
+        except HTTPClientError:
+            logging.exception("Could not get a cat")
+            cat_url = "All cats are asleep right now :( (Could not reach thecatapi.com, try again later)"
+        yield from self.client.send_message(message.channel, cat_url)
 
 
+@bot_command("!evetime")
 class EveTimeCommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!evetime"
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
@@ -188,11 +228,11 @@ class EveTimeCommand:
         yield from self.client.send_message(message.channel, "Current EVE Time " + str(datetime.utcnow()))
 
 
+@bot_command("!uptime")
 class UptimeBotCommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!uptime"
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
@@ -200,24 +240,24 @@ class UptimeBotCommand:
         yield from self.client.send_message(message.channel, "I'm up since " + str(self.client.start_time))
 
 
+@bot_command("!list_my_roles")
 class ListMyRolesCommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!list_my_roles"
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
         if message.channel == self.client.debug_channel:
-            roles = self.client.get_member_roles(message.author.id)
+            roles = yield from self.client.get_member_roles(message.author.id)
             yield from self.client.send_message(message.channel, ",".join(roles))
 
 
+@bot_command("!update_roles")
 class UpdateRolesCommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!update_roles"
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
@@ -226,11 +266,74 @@ class UpdateRolesCommand:
             self.client.update_roles(self.client.main_server)
             yield from self.client.send_message(message.channel, self.client.get_roles_str(self.client.main_server))
 
+@bot_command("!db_stats")
+class DatabaseStatsCommand:
+    def __init__(self, db_model, discord_client):
+        self.client = discord_client
+        self.model = db_model
+
+    @asyncio.coroutine
+    def handle_command(self, message, cmd, params):
+        logging.info("in DatabaseStatsCommand.handle_command()")
+        if message.channel == self.client.debug_channel:
+            for label, source in self.client.metrics_sources():
+                yield from self.client.send_message(message.channel, label + ": " + format_metrics(source.metrics()))
+
+@bot_command("!fleetbot_stats")
+class FleetbotStatsCommand:
+    def __init__(self, db_model, discord_client):
+        self.client = discord_client
+        self.model = db_model
+
+    @asyncio.coroutine
+    def handle_command(self, message, cmd, params):
+        logging.info("in FleetbotStatsCommand.handle_command()")
+        if message.channel == self.client.debug_channel:
+            lines = []
+            for stats in self.client.fleetbot_fanout.delivery_stats.values():
+                lines.append("{}: sent={}, failed={}, last latency={:.2f}s, last error={}".format(
+                    stats['channel'], stats['sent'], stats['failed'], stats['last_latency'], stats['last_error']))
+            if len(lines) == 0:
+                lines.append("No fleetbot messages delivered yet")
+            yield from self.client.send_message(message.channel, "\n".join(lines))
+
+@bot_command("!reload_staticdata")
+class ReloadStaticDataCommand:
+    def __init__(self, db_model, discord_client):
+        self.client = discord_client
+        self.model = db_model
+
+    @asyncio.coroutine
+    def handle_command(self, message, cmd, params):
+        logging.info("in ReloadStaticDataCommand.handle_command()")
+        if message.channel == self.client.debug_channel:
+            yield from self.client.static_data.load()
+            yield from self.client.send_message(message.channel, "Static data reloaded: {} systems, {} items".format(
+                len(self.client.static_data.systems), len(self.client.static_data.items)))
+
+@bot_command("!shard_stats")
+class ShardStatsCommand:
+    def __init__(self, db_model, discord_client):
+        self.client = discord_client
+        self.model = db_model
+
+    @asyncio.coroutine
+    def handle_command(self, message, cmd, params):
+        logging.info("in ShardStatsCommand.handle_command()")
+        if message.channel == self.client.debug_channel:
+            shards = self.client.shards
+            lines = ["Shard {} of {}, {} pending member checks".format(shards.shard_index, shards.shard_count,
+                                                                      len(self.client.pending_member_checks))]
+            metrics = shards.metrics()
+            for worker in sorted(metrics.keys()):
+                lines.append("Worker {}: {}".format(worker, format_metrics(metrics[worker])))
+            yield from self.client.send_message(message.channel, "\n".join(lines))
+
+@bot_command("!spain")
 class SpainCommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!spain"
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
@@ -238,11 +341,11 @@ class SpainCommand:
         yield from self.client.send_message(message.channel, "Yes no :es: ")
 
 
+@bot_command("!penis")
 class PenisCommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!penis"
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
@@ -250,22 +353,22 @@ class PenisCommand:
         yield from self.client.send_message(message.channel, "Why????!???")
 
 
+@bot_command("!spirit")
 class SpiritOneCommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!spirit"
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
         logging.info("in SpiritOneCommand.handle_command()")
         yield from self.client.send_message(message.channel, "http://www.mtv.co.uk/sites/default/files/styles/carousel_wide/public/mtv_uk/articles/2014/09/18/bxmsvi0igaacgph.jpg?itok=q5ZARzHl")
 
+@bot_command("!danish")
 class DanishCommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!danish"
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
@@ -273,11 +376,11 @@ class DanishCommand:
         yield from self.client.send_message(message.channel, "http://itsfunny.org/wp-content/uploads/2013/01/Danish-tourist-on-vacantion.jpg")
 
 
+@bot_command("!australia")
 class AustraliaCommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!australia"
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
@@ -286,11 +389,11 @@ class AustraliaCommand:
 
 
 
+@bot_command("!camel")
 class CamelBotCommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!camel"
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
@@ -298,11 +401,11 @@ class CamelBotCommand:
         yield from self.client.send_message(message.channel, "https://www.youtube.com/watch?v=ZBIGwtyqBhA")
 
 
+@bot_command("!moose")
 class MooseBotCommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!moose"
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
@@ -310,11 +413,11 @@ class MooseBotCommand:
         yield from self.client.send_message(message.channel, "https://www.youtube.com/watch?v=--PyKhohVcY")
 
 
+@bot_command("!pk")
 class PKCommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!pk"
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
@@ -322,11 +425,11 @@ class PKCommand:
         yield from self.client.send_message(message.channel, "I heard PK is a :whale:")
 
 
+@bot_command("!death")
 class DeathCommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!death"
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
@@ -334,11 +437,11 @@ class DeathCommand:
         yield from self.client.send_message(message.channel, "https://www.youtube.com/watch?v=hdcTmpvDO0I")
 
 
+@bot_command("!white")
 class WhiteCommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!white"
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
@@ -346,11 +449,11 @@ class WhiteCommand:
         yield from self.client.send_message(message.channel, "http://41.media.tumblr.com/tumblr_ls2cgdq2yL1qa04m7o1_500.png")
 
 
+@bot_command("!pos")
 class FindPOSBotCommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!pos"
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
@@ -359,13 +462,14 @@ class FindPOSBotCommand:
         if "directors" in channelname or "managers" in channelname or "debug" in channelname or "it_room" in channelname:
             poslist = None
             if params == "":
-                poslist = self.model.find_pos()
+                poslist = yield from self.model.find_pos()
             else:
-                result = self.model.find_system(params)
+                yield from self.client.static_data.ensure_loaded()
+                result = self.client.static_data.find_system(params)
                 if result == None:
                     yield from self.client.send_message(message.channel, "<@" + message.author.id + "> Unknown System")
                 elif isinstance(result, dict):
-                    poslist = self.model.find_pos(result['solarSystemID'])
+                    poslist = yield from self.model.find_pos(result['solarSystemID'])
                 else:
                     resultstr = ", ".join(result)
                     yield from self.client.send_message(message.channel,
@@ -380,20 +484,21 @@ class FindPOSBotCommand:
                                                     "<@" + message.author.id + "> " + pos_str)
 
 
+@bot_command("!item")
 class FindItemBotCommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!item"
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
         logging.info("in FindItemBotCommand.handle_command()")
-        result = self.model.find_item(params)
+        yield from self.client.static_data.ensure_loaded()
+        result = self.client.static_data.find_item(params)
         if result == None:
             yield from self.client.send_message(message.channel, "<@" + message.author.id + "> Unknown Item")
         elif isinstance(result, dict):
-            isk = self.model.get_item_price(result['id'])
+            isk = yield from self.client.prices.get_price(result['id'])
             if isk != None:
                 price = " ({:,}".format(isk) + " ISK)"
             else:
@@ -408,16 +513,17 @@ class FindItemBotCommand:
 
 
 
+@bot_command("!system")
 class FindSystemBotCommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!system"
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
         logging.info("in FindSystemBotCommand.handle_command()")
-        result = self.model.find_system(params)
+        yield from self.client.static_data.ensure_loaded()
+        result = self.client.static_data.find_system(params)
         if result == None:
             yield from self.client.send_message(message.channel, "<@" + message.author.id + "> Unknown System")
         elif isinstance(result, dict):
@@ -430,6 +536,7 @@ class FindSystemBotCommand:
                                                 "<@" + message.author.id + "> Which one did you mean? " + resultstr)
 
 
+@bot_command("!cookie")
 class CookieBotCommand:
     cookie_messages = ["I think you need a :cookie:", "Have a :cookie:",
                        "Have two :cookie:", "Sorry, I am out of cookies! Oh wait, found one! :cookie:",
@@ -465,7 +572,6 @@ class CookieBotCommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!cookie"
         self.stats = {}
 
     @asyncio.coroutine
@@ -496,11 +602,11 @@ class CookieBotCommand:
                 yield from self.client.send_message(message.channel, "You already got " + str(cnt) + " cookies!")
 
 
+@bot_command("!whiskey")
 class WhiskeyBotCommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!whiskey"
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
@@ -508,18 +614,18 @@ class WhiskeyBotCommand:
         yield from self.client.send_message(message.channel, "<@" + message.author.id + "> invites everybody to drink a whiskey!")
 
 
+@bot_command("!kills")
 class KillboardBotCommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!kills"
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
         logging.info("in KillboardBotCommand.handle_command()")
         # get number of kills of this member
         if message.author.id in self.client.authed_users:
-            number_kills = self.model.get_discord_members_number_of_kills(message.author.id)
+            number_kills = yield from self.model.get_discord_members_number_of_kills(message.author.id)
             if number_kills < 100:
                 yield from self.client.send_message(message.channel, "Whelp... you only have %d killmails... " % number_kills)
             elif number_kills < 500:
@@ -536,11 +642,11 @@ class KillboardBotCommand:
             yield from self.client.send_message(message.channel, "I do not have any kill records of you!")
 
 
+@bot_command("!ops")
 class OpsBotcommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!ops"
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
@@ -548,11 +654,11 @@ class OpsBotcommand:
         yield from self.client.send_message(message.channel, "Please visit https://ncdot.co.uk/forum/")
 
 
+@bot_command("!help", aliases=["!commands"])
 class HelpBotcommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!help"
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
@@ -568,11 +674,11 @@ This Discord Bot supports many commands, among them:
                                             )
 
 
+@bot_command("!scotch")
 class ScotchBotCommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!scotch"
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
@@ -582,11 +688,11 @@ class ScotchBotCommand:
 
 
 
+@bot_command("!cafe")
 class CafeBotCommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!cafe"
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
@@ -594,11 +700,11 @@ class CafeBotCommand:
         yield from self.client.send_message(message.channel, "<@" + message.author.id + "> hands out coffee!")
 
 
+@bot_command("!cake")
 class CakeBotCommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!cake"
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
@@ -606,6 +712,7 @@ class CakeBotCommand:
         yield from self.client.send_message(message.channel, "The cake is a lie!")
 
 
+@bot_command("!beer")
 class BeerBotCommand:
     messages = ["Beer is proof that God loves us and wants us to be happy. :beer:"
                 "Milk is for babies. When you grow up you have to drink beer. :beer:",
@@ -628,7 +735,6 @@ class BeerBotCommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!beer"
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
@@ -638,11 +744,11 @@ class BeerBotCommand:
         yield from self.client.send_message(message.channel, BeerBotCommand.messages[idx])
 
 
+@bot_command("!usa")
 class USABotCommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!usa"
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
@@ -650,22 +756,29 @@ class USABotCommand:
         yield from self.client.send_message(message.channel, "USA! USA! U S A! U S A! :us:")
 
 
+@bot_command("!wiki")
 class WikiBotcommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!wiki"
+        self.url = "https://en.wikipedia.org/w/api.php"
+
+    @asyncio.coroutine
+    def search(self, search_str):
+        """ lookup search_str at wikipedia api """
+        query = {'action': 'opensearch', 'search': search_str, 'limit': 1, 'namespace': 0, 'format': 'json'}
+        return (yield from self.client.http_client.get_json(self.url, query))
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
         logging.info("in WikiBotcommand.handle_command()")
-        # lookup params at wikipedia api
-        search_q = urllib.parse.quote(params)
-        url = "https://en.wikipedia.org/w/api.php?action=opensearch&search=" + search_q + "&limit=1&namespace=0&format=json"
-        response = urllib.request.urlopen(url)
-        response = str(response.read().decode())
-
-        data = json.loads(response)
+        try:
+            # repeated searches are answered from the cache
+            data = yield from self.client.wiki_cache.get(params.strip().lower(), self.search)
+        except HTTPClientError:
+            logging.exception("Could not query wikipedia")
+            yield from self.client.send_message(message.channel, "Could not reach wikipedia, try again later")
+            return
 
         if len(data)> 0 and len(data[1]) > 0:
             msg = str(data[3][0])
@@ -674,11 +787,11 @@ class WikiBotcommand:
 
 
 
+@bot_command("!pingme")
 class ModifyPingTimespanCommand:
     def __init__(self, db_model, discord_client):
         self.client = discord_client
         self.model = db_model
-        self.cmd = "!pingme"
 
     @asyncio.coroutine
     def handle_command(self, message, cmd, params):
@@ -710,7 +823,9 @@ class ModifyPingTimespanCommand:
             if stop_hour > 24:
                 stop_hour = 24
 
-            self.model.update_ping_start_stop_hour(message.author.id, start_hour, stop_hour)
+            yield from self.model.update_ping_start_stop_hour(message.author.id, start_hour, stop_hour)
+            # roles are updated right away if the new window opens or closes the current hour
+            self.client.set_ping_window(message.author.id, start_hour, stop_hour)
 
             yield from self.client.send_message(message.channel,
                                                 "<@" + message.author.id + "> Okay, I will ping you between " + str(start_hour) + ":00 and " + str(stop_hour) + ":00 UTC (EVE Time)")
@@ -0,0 +1,262 @@
+""" Caches for data which is expensive to look up (database or external APIs) """
+
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict, deque
+
+
+class TTLCache:
+    """ A LRU cache with at most max_size entries, which expire ttl seconds
+    after they were stored. get() returns TTLCache.MISSING for unknown or
+    expired keys (None is a valid cached value) """
+
+    MISSING = object()
+
+    def __init__(self, max_size=1000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict() # key -> (stored_at, value), least recently used first
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """ returns the cached value of key, or MISSING """
+        entry = self.entries.get(key)
+        if entry is None or time.time() - entry[0] > self.ttl:
+            self.misses += 1
+            return TTLCache.MISSING
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value):
+        """ stores value for key, evicts the least recently used entry if full """
+        self.entries[key] = (time.time(), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def get_stale(self, key):
+        """ returns the cached value of key even if it expired, or MISSING """
+        entry = self.entries.get(key)
+        if entry is None:
+            return TTLCache.MISSING
+        return entry[1]
+
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total > 0 else 0.0
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class PriceCache:
+    """ Serves item prices from memory: the whole prices table is reloaded with
+    one query every refresh_interval seconds (see refresh_loop). While that
+    snapshot is older than max_staleness seconds (e.g., the refresh failed),
+    prices are looked up one by one and kept in a TTLCache. """
+
+    def __init__(self, model, refresh_interval=300, max_staleness=900, max_size=5000):
+        self.model = model
+        self.refresh_interval = refresh_interval
+        self.max_staleness = max_staleness
+
+        self.prices = {} # type id -> sell price, from the last bulk refresh
+        self.refreshed_at = 0
+        self.point_cache = TTLCache(max_size, refresh_interval)
+
+        self.hits = 0
+        self.misses = 0
+
+    def staleness(self):
+        """ returns the age of the price snapshot in seconds """
+        return time.time() - self.refreshed_at
+
+    @asyncio.coroutine
+    def refresh(self):
+        """ reloads all prices from the database """
+        start = time.time()
+        self.prices = yield from self.model.get_all_prices()
+        self.refreshed_at = time.time()
+        logging.info("PriceCache: loaded %d prices in %.2f seconds", len(self.prices), self.refreshed_at - start)
+
+    @asyncio.coroutine
+    def refresh_loop(self):
+        """ refreshes the prices every refresh_interval seconds """
+        while True:
+            try:
+                yield from self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("PriceCache: refreshing prices failed")
+            yield from asyncio.sleep(self.refresh_interval)
+
+    @asyncio.coroutine
+    def get_price(self, item_type_id):
+        """ returns the sell price of an item (None if there is none) """
+        if self.staleness() <= self.max_staleness:
+            # the snapshot holds the whole table, so a missing id has no price
+            self.hits += 1
+            return self.prices.get(item_type_id)
+
+        price = self.point_cache.get(item_type_id)
+        if price is not TTLCache.MISSING:
+            self.hits += 1
+            return price
+
+        self.misses += 1
+        price = yield from self.model.get_item_price(item_type_id)
+        self.point_cache.put(item_type_id, price)
+        return price
+
+    def metrics(self):
+        """ returns a dictionary with cache statistics """
+        total = self.hits + self.misses
+        return {
+            'prices': len(self.prices),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(float(self.hits) / total, 3) if total > 0 else 0.0,
+            'staleness_s': int(self.staleness()) if self.refreshed_at > 0 else -1,
+            'point_cache_entries': len(self.point_cache)
+        }
+
+
+class LookupCache:
+    """ Caches the results of an external lookup (e.g., a wikipedia search) by
+    key in a TTLCache. Concurrent lookups of the same key share one request. If
+    the lookup fails, the last (expired) result is served instead. """
+
+    def __init__(self, max_size=500, ttl=3600):
+        self.cache = TTLCache(max_size, ttl)
+        self.in_flight = {} # key -> future of a running lookup
+        self.stale_served = 0
+
+    @asyncio.coroutine
+    def get(self, key, fetch):
+        """ returns the cached result for key, or the result of the coroutine
+        function fetch(key) """
+        value = self.cache.get(key)
+        if value is not TTLCache.MISSING:
+            return value
+
+        future = self.in_flight.get(key)
+        if future is not None:
+            return (yield from asyncio.shield(future))
+
+        future = asyncio.Future()
+        self.in_flight[key] = future
+        try:
+            value = yield from fetch(key)
+            self.cache.put(key, value)
+            future.set_result(value)
+        except Exception as e:
+            value = self.cache.get_stale(key)
+            if value is TTLCache.MISSING:
+                future.set_exception(e)
+                # concurrent lookups of key (if any) get the exception as well, it
+                # must not be logged as never retrieved if there are none
+                future.exception()
+                raise
+            logging.info("LookupCache: lookup of '%s' failed (%s), serving a stale result", key, e)
+            self.stale_served += 1
+            future.set_result(value)
+        finally:
+            del self.in_flight[key]
+            if not future.done():
+                # the lookup got cancelled, do not leave concurrent lookups waiting forever
+                future.cancel()
+
+        return value
+
+    def metrics(self):
+        """ returns a dictionary with cache statistics """
+        return {
+            'entries': len(self.cache),
+            'hit_ratio': round(self.cache.hit_ratio(), 3),
+            'stale_served': self.stale_served
+        }
+
+
+class PrefetchPool:
+    """ Keeps up to size results of a lookup which returns random content (a
+    joke, a cat picture) ready, so get() just pops one and the pool is refilled
+    in the background. If the pool is empty and the lookup fails, one of the
+    recently served results is served again. """
+
+    def __init__(self, size=5, max_age=3600, keep_served=20):
+        self.size = size
+        self.max_age = max_age
+        self.items = deque() # (fetched at, item)
+        self.served = deque(maxlen=keep_served)
+        self.refill_task = None
+
+        self.hits = 0
+        self.misses = 0
+        self.stale_served = 0
+
+    def _pop(self):
+        """ returns the oldest prefetched item which has not expired, or None """
+        while len(self.items) > 0:
+            fetched_at, item = self.items.popleft()
+            if time.time() - fetched_at <= self.max_age:
+                return item
+        return None
+
+    @asyncio.coroutine
+    def get(self, fetch):
+        """ returns a prefetched item, or the result of the coroutine function fetch() """
+        item = self._pop()
+        if item is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            try:
+                item = yield from fetch()
+            except Exception as e:
+                if len(self.served) == 0:
+                    raise
+                logging.info("PrefetchPool: fetch failed (%s), serving a recent item", e)
+                self.stale_served += 1
+                return random.choice(self.served)
+
+        self.served.append(item)
+        self.start_refill(fetch)
+        return item
+
+    def start_refill(self, fetch):
+        """ refills the pool in the background (unless that is already happening) """
+        if self.refill_task is None or self.refill_task.done():
+            self.refill_task = asyncio.async(self.refill(fetch))
+
+    @asyncio.coroutine
+    def refill(self, fetch):
+        """ fetches items until the pool is full, gives up on the first error """
+        while len(self.items) < self.size:
+            try:
+                item = yield from fetch()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("PrefetchPool: refill failed")
+                return
+            self.items.append((time.time(), item))
+
+    def stop(self):
+        if self.refill_task is not None:
+            self.refill_task.cancel()
+            self.refill_task = None
+
+    def metrics(self):
+        """ returns a dictionary with pool statistics """
+        total = self.hits + self.misses
+        return {
+            'ready': len(self.items),
+            'hit_ratio': round(float(self.hits) / total, 3) if total > 0 else 0.0,
+            'stale_served': self.stale_served
+        }
@@ -0,0 +1,100 @@
+""" Buffers debug channel messages and posts them as one digest message """
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+
+# discord rejects messages longer than 2000 characters
+MAX_MESSAGE_LENGTH = 1900
+
+
+class DebugDigest:
+    """ Collects debug events and sends them with send_func(msg) as a compact
+    summary every flush_interval seconds, or as soon as max_events different
+    events are buffered. Identical events are sent once, with a count. """
+
+    def __init__(self, send_func, flush_interval=30, max_events=50):
+        self.send_func = send_func # coroutine function send_func(msg)
+        self.flush_interval = flush_interval
+        self.max_events = max_events
+
+        self.events = OrderedDict() # msg -> count, in order of the first occurrence
+        self.first_event_at = None
+        self.flush_event = None
+
+        # metrics
+        self.buffered = 0
+        self.sent_messages = 0
+
+    def add(self, msg):
+        """ buffers msg for the next digest """
+        if len(self.events) == 0:
+            self.first_event_at = time.time()
+        self.events[msg] = self.events.get(msg, 0) + 1
+        self.buffered += 1
+
+        if len(self.events) >= self.max_events and self.flush_event is not None:
+            self.flush_event.set()
+
+    def format(self, events):
+        """ returns the digest of events as a list of messages (each fits into a discord message) """
+        lines = []
+        for msg, count in events.items():
+            if count > 1:
+                msg = "{} (x{})".format(msg, count)
+            if len(msg) > MAX_MESSAGE_LENGTH:
+                msg = msg[:MAX_MESSAGE_LENGTH - 3] + "..."
+            lines.append(msg)
+
+        messages = []
+        current = ""
+        for line in lines:
+            if len(current) + len(line) + 1 > MAX_MESSAGE_LENGTH:
+                messages.append(current)
+                current = ""
+            current = line if current == "" else current + "\n" + line
+        if current != "":
+            messages.append(current)
+        return messages
+
+    @asyncio.coroutine
+    def flush(self):
+        """ sends all buffered events """
+        if len(self.events) == 0:
+            return
+        events, self.events = self.events, OrderedDict()
+        age = time.time() - self.first_event_at
+
+        messages = self.format(events)
+        messages[0] = "Digest of {} events in the last {} seconds:\n{}".format(sum(events.values()), int(age), messages[0])
+        for msg in messages:
+            yield from self.send_func(msg)
+            self.sent_messages += 1
+
+    @asyncio.coroutine
+    def flush_loop(self):
+        """ flushes every flush_interval seconds, or earlier if the buffer is full """
+        self.flush_event = asyncio.Event()
+        while True:
+            try:
+                yield from asyncio.wait_for(self.flush_event.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_event.clear()
+
+            try:
+                yield from self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("DebugDigest: could not send digest")
+
+    def metrics(self):
+        """ returns a dictionary with digest statistics """
+        return {
+            'buffered_events': self.buffered,
+            'pending': len(self.events),
+            'sent_messages': self.sent_messages
+        }
@@ -3,34 +3,35 @@
 import sys
 import asyncio
 import logging
-import random
+import time
+import functools
 from datetime import datetime
 import traceback
 
-from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import discord
-from model import MyDBModel
+from model import MyDBModel, AsyncDBModel
 
 import bot_commands
 from bot_commands import AbstractBotCommand
+from scheduler import OutboundScheduler, RateLimitObservingSession
+from scheduler import PRIORITY_FLEET, PRIORITY_AUTH, PRIORITY_ROLES, PRIORITY_DEBUG, DEFAULT_PRIORITY
+from fleetbot import FleetbotFanout, create_ping_source
+from staticdata import StaticDataIndex
+from cache import PriceCache, LookupCache, PrefetchPool
+from router import CommandRouter, parse_command
+from autoresponder import AutoResponder
+from http_client import AsyncHTTPClient
+from digest import DebugDigest
+from member_index import MemberIndex
+from ping_schedule import PingWindowSchedule
+from sharding import ShardCoordinator
+import snapshot
+from startup import StartupTimer
 
 import importlib
 
 
-cookie_messages = ["I think you need a :cookie:", "Have a :cookie:",
-                   "Have two :cookie:", "Sorry, I am out of cookies! Oh wait, found one! :cookie:",
-                   "C is for :cookie:", "https://www.youtube.com/watch?v=Ye8mB6VsUHw",
-                   "https://www.youtube.com/watch?v=-qTIGg3I5y8", "I think you had enough!",
-                   "Okay, but only one more :cookie:!", "I like cookies too! :thumbsup:",
-                   "Please wait, while we process your request...", "Free Cookies for everyone! :cookie: :cookie: :cookie: :cookie: :cookie:",
-                   "Omnomnomnomnom... You want a :cookie: too?", "Sorry, but Deathwhisper ate all my cookies :(",
-                   "Are you sure?", "The cookie is a lie!", "Ofcourse! Here is a :cookie: for you!",
-                   "Share your :cookie: with a friend!", "Cookie? :cookie:", "NO!",
-                   "http://i4.manchestereveningnews.co.uk/incoming/article10580003.ece/ALTERNATES/s615/JS47622759.jpg",
-                   "Waiting on a cookie delivery...", "Nobody ever gives me cookies :(",
-                   "Omnomnomnom sorry, that was the last one!"]
-
 # Create a subclass of Client that defines our own event handlers
 # Another option is just to write functions decorated with @client.async_event
 class MyDiscordBotClient(discord.Client):
@@ -38,25 +39,55 @@ class MyDiscordBotClient(discord.Client):
     handles authentication with a pre-defined EvE Online auth database """
     def __init__(self, db, debug_channel_name, auth_website, main_server_id,
                  time_dep_groups, fleetbot_channels, post_expensive_killmails_to,
-                 run_verify_user_loop=True):
-        self.db = db # the database
+                 run_verify_user_loop=True, full_sweep_interval=900, db_poll_interval=60,
+                 fleetbot_batch_size=100, fleetbot_ping_source="db",
+                 fleetbot_poll_min_interval=1, fleetbot_poll_max_interval=10,
+                 price_refresh_interval=300, autoresponder_rules=None,
+                 command_max_concurrent=8, command_user_limit=5, command_channel_limit=15,
+                 command_limit_period=10, debug_digest_interval=30, debug_digest_max_events=50,
+                 auth_maintenance_interval=3600, shard_index=0, shard_count=1, reconcile_workers=4,
+                 snapshot_file="snapshot.json.gz", snapshot_interval=300, snapshot_max_age=900,
+                 snapshot_fleetbot_max_age=30, startup_timer=None):
+        self.db = db # the database connection pool
+        # how long the startup took, reported once the bot is ready (see startup.StartupTimer)
+        self.startup_timer = startup_timer
         self.debug_channel_name = debug_channel_name
         self.auth_website = auth_website
 
-        # store the database model
-        self.model = MyDBModel(self.db)
+        # store the database model (all queries run in a thread pool, see AsyncDBModel)
+        self.model = AsyncDBModel(MyDBModel(self.db))
+
+        # systems and items, for lookups without hitting the database
+        self.static_data = StaticDataIndex(self.model)
+        # item prices, reloaded in bulk every price_refresh_interval seconds
+        self.prices = PriceCache(self.model, price_refresh_interval)
 
         self.authed_users = {}
+        # last_updated of the newest discord_auth row we know, None: reload all authed users
+        self.auth_high_water_mark = None
+        self.auth_maintenance_interval = auth_maintenance_interval
+        # which members this instance reconciles, and with how many concurrent workers
+        self.shards = ShardCoordinator(shard_index, shard_count, reconcile_workers)
+        # ping windows (!pingme) of the authed users, by hour
+        self.ping_schedule = PingWindowSchedule()
+        # snapshot of member id -> set of role ids from the database, refreshed once per sweep
+        self.member_roles = {}
 
         # Store a couple of destinations for messages
         self.debug_channel = None
+        # debug messages are sent as a digest every debug_digest_interval seconds (0: right away)
+        self.debug_digest_interval = debug_digest_interval
+        self.debug_digest = DebugDigest(functools.partial(self.send_to_debug_channel, urgent=True),
+                                        debug_digest_interval, debug_digest_max_events)
 
         self.group_channels = {}
 
         self.post_expensive_killmails_to = post_expensive_killmails_to
         self.post_expensive_killmails_channel = None
 
-        self.currently_online_members = {} # a list of online users
+        # members of the main server by id, updated from gateway events
+        self.members = MemberIndex()
+        self.currently_online_members = set() # ids of members which were verified since they came online
         self.roles = {}
         self.everyone_group = None
 
@@ -66,14 +97,65 @@ class MyDiscordBotClient(discord.Client):
         # store the time when the bot started
         self.start_time = datetime.now()
 
+        # keep-alive connections to external APIs (used by !chuck, !cat, !wiki, ...)
+        self.http_client = AsyncHTTPClient()
+        # wikipedia search results by query, and prefetched jokes and cat pictures
+        self.wiki_cache = LookupCache(max_size=500, ttl=3600)
+        self.joke_pool = PrefetchPool(size=5)
+        self.cat_pool = PrefetchPool(size=5)
+
+        # keyword triggers ("I LOVE", ...) from the [Autorespond:...] config sections
+        self.autoresponder = AutoResponder(autoresponder_rules if autoresponder_rules is not None else [])
+
+        # maps "!command" to its handler; admin commands only work in the debug channel
+        self.router = CommandRouter(self.send_message, command_max_concurrent, command_user_limit,
+                                    command_channel_limit, command_limit_period)
+        self.router.add("!reload_commands", self.reload_commands, admin_only=True)
+        self.router.add("!restart", self.restart, admin_only=True)
+        self.router.add("!clear_online_members", self.handle_clear_online_members, admin_only=True)
+
         self.timedep_group_assignment = {}
         self.fleetbot_channels = {}
 
         self.verify_users_loop = None
+        self.reconcile_members_loop = None
         self.forward_fleetbot_loop = None
         self.forward_zkill_loop = None
+        self.refresh_prices_loop = None
+        self.debug_digest_loop = None
+        self.auth_maintenance_loop = None
+        self.ping_window_loop = None
+        self.save_snapshot_loop = None
+
+        # state is saved to snapshot_file every snapshot_interval seconds and on shutdown,
+        # and restored on startup if it is not older than snapshot_max_age seconds
+        self.snapshot_file = snapshot_file
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_max_age = snapshot_max_age
+        # the fleetbot position is only restored from a snapshot which was saved just before
+        # the restart (e.g., on shutdown), an older one would send pings again or send stale pings
+        self.snapshot_fleetbot_max_age = snapshot_fleetbot_max_age
+        self.snapshot_restored = False
+        self.killmail_last_id = 0
 
         self.do_verify_users = run_verify_user_loop
+        # members are reconciled when discord tells us about changes, and when
+        # the database changes; a full sweep is only done every full_sweep_interval seconds
+        self.full_sweep_interval = full_sweep_interval
+        self.db_poll_interval = db_poll_interval
+        self.pending_member_checks = set()
+        self.pending_member_event = None
+
+        # all outgoing messages and role updates are rate limited by this scheduler
+        self.outbound = OutboundScheduler()
+
+        # sends fleetbot pings to all channels of a group concurrently
+        self.fleetbot_fanout = FleetbotFanout(functools.partial(self.send_message, priority=PRIORITY_FLEET))
+        # maximum number of fleetbot messages fetched from the database at once
+        self.fleetbot_batch_size = fleetbot_batch_size
+        # where fleetbot pings come from (database poller or a push feed)
+        self.ping_source = create_ping_source(fleetbot_ping_source, self.model, fleetbot_batch_size,
+                                              fleetbot_poll_min_interval, fleetbot_poll_max_interval)
 
 
         if time_dep_groups != "":
@@ -105,12 +187,23 @@ class MyDiscordBotClient(discord.Client):
         # call super class init
         super(MyDiscordBotClient, self).__init__()
 
+        if self.startup_timer is None:
+            self.startup_timer = StartupTimer()
+        self.startup_timer.mark("client")
+
     @asyncio.coroutine
     def on_ready(self):
         """Asynchronous event handler for when we are fully ready to interact
         with the server"""
         logging.info("OnReady: Logged in as %s (id: %s)",
                      self.user.name, self.user.id)
+        # the timer only reports the first startup, not reconnects
+        timer = self.startup_timer if not self.startup_timer.reported else StartupTimer()
+        timer.mark("login")
+
+        # let the outbound scheduler see the rate limit headers of all API responses
+        if not isinstance(self.http.session, RateLimitObservingSession):
+            self.http.session = RateLimitObservingSession(self.http.session, self.outbound)
 
         logging.info("Checking which servers we are connected to")
         for serv in self.servers:
@@ -125,37 +218,117 @@ class MyDiscordBotClient(discord.Client):
 
         # update list of available roles
         self.update_roles(self.main_server)
+        timer.mark("servers")
+
+        # after a restart, continue where we stopped (only once, a reconnect keeps the state anyway)
+        if not self.snapshot_restored:
+            self.snapshot_restored = True
+            state = snapshot.load_snapshot(self.snapshot_file, self.snapshot_max_age)
+            if state is not None:
+                self.restore_snapshot_state(state)
+
+        # from now on the member index is updated by the member join/update/remove events
+        self.members.load(self.main_server.members, self.authed_users.keys())
+        timer.mark("members")
 
         # Send a message to a destination
-        yield from self.send_to_debug_channel("I am back {}!".format(str(datetime.now())))
+        yield from self.send_to_debug_channel("I am back {}!".format(str(datetime.now())), urgent=True)
 
         AbstractBotCommand.import_bot_commands(self.model, self)
+        AbstractBotCommand.add_routes(self.router)
+        timer.mark("commands")
 
         # verify users, run this until the end
         logging.info("starting async loops...")
+        # on_ready is called again after a reconnect, make sure the loops are not started twice
+        self.stop_additional_loops()
         loop = asyncio.get_event_loop()
+        self.pending_member_event = asyncio.Event()
         self.verify_users_loop = asyncio.async(self.verify_users(self.main_server))
+        self.reconcile_members_loop = asyncio.async(self.reconcile_pending_members(self.main_server))
+
+        if len(self.timedep_group_assignment) > 0:
+            self.ping_window_loop = asyncio.async(self.update_ping_windows())
+
+        if self.debug_digest_interval > 0:
+            self.debug_digest_loop = asyncio.async(self.debug_digest.flush_loop())
+
+        if self.snapshot_interval > 0:
+            self.save_snapshot_loop = asyncio.async(self.save_snapshots())
+
+        # every shard reloads all authed members now and then (deleted rows)
+        self.auth_maintenance_loop = asyncio.async(self.auth_maintenance())
+
+        timer.mark("loops")
+        if timer is self.startup_timer:
+            timer.reported = True
+            logging.info("Startup: %s", timer.report())
+        else:
+            logging.info("Reconnect: %s", timer.report())
+
+        if not self.shards.is_primary():
+            # the other loops only run on the primary instance
+            logging.info("Running as shard %d of %d, only reconciling roles", self.shards.shard_index, self.shards.shard_count)
+            return
+
+        # only the primary instance answers commands like !item and !system
+        if not self.static_data.loaded:
+            asyncio.async(self.static_data.load())
+
         if len(self.fleetbot_channels) > 0:
             logging.info("Starting new fleetbot loop, checking old loop before")
             logging.info(self.forward_fleetbot_loop)
 
+            # continue delivering the messages which were queued before the reconnect
+            self.fleetbot_fanout.start([channel for channels in self.group_channels.values() for channel in channels])
             self.forward_fleetbot_loop = asyncio.async(self.forward_fleetbot_messages())
 
         # start forward zkill loop
         if self.forward_zkillboard_expensive_killmails != "":
             self.forward_zkill_loop = asyncio.async(self.forward_zkillboard_expensive_killmails())
 
-    def stop_additional_loops(self):
-        """ stops verify users loop and forward fleetbot loop """
+        self.refresh_prices_loop = asyncio.async(self.prices.refresh_loop())
+
+    def stop_additional_loops(self, shutdown=False):
+        """ stops verify users loop and forward fleetbot loop; on shutdown, also
+        drops the calls waiting in the outbound scheduler and closes the ping source
+        (on_ready calls this after a reconnect, queued messages are kept then) """
         if self.verify_users_loop:
             logging.info("stopping verify user loop")
             self.verify_users_loop.cancel()
+        if self.reconcile_members_loop:
+            logging.info("stopping reconcile members loop")
+            self.reconcile_members_loop.cancel()
         if self.forward_fleetbot_loop:
             logging.info("stopping forward fleetbot loop")
             self.forward_fleetbot_loop.cancel()
         if self.forward_zkill_loop:
             logging.info("stopping forward zkill loop")
             self.forward_zkill_loop.cancel()
+        if self.refresh_prices_loop:
+            logging.info("stopping refresh prices loop")
+            self.refresh_prices_loop.cancel()
+        if self.debug_digest_loop:
+            logging.info("stopping debug digest loop")
+            self.debug_digest_loop.cancel()
+        if self.auth_maintenance_loop:
+            logging.info("stopping auth maintenance loop")
+            self.auth_maintenance_loop.cancel()
+        if self.ping_window_loop:
+            logging.info("stopping ping window loop")
+            self.ping_window_loop.cancel()
+        if self.save_snapshot_loop:
+            logging.info("stopping save snapshot loop")
+            self.save_snapshot_loop.cancel()
+        # the fanout keeps its undelivered messages, the workers are started again by on_ready
+        self.fleetbot_fanout.stop()
+        self.router.stop()
+        self.joke_pool.stop()
+        self.cat_pool.stop()
+        self.http_client.close()
+        if shutdown:
+            self.ping_source.stop()
+            self.outbound.stop()
 
 
     def update_channels(self, server):
@@ -207,30 +380,35 @@ class MyDiscordBotClient(discord.Client):
         """ handles an auth token sent by author """
 
         logging.info("Verifying auth token '%s' for user %s", auth_token, str(author.name))
-        if self.model.is_auth_code_in_table(auth_token):
+        is_valid = yield from self.model.is_auth_code_in_table(auth_token)
+        if is_valid:
             logging.info("Token is valid!")
             # update member_id for auth_code
-            self.model.set_discord_member_id_for_auth_code(auth_token, str(author.id))
+            yield from self.model.set_discord_member_id_for_auth_code(auth_token, str(author.id))
 
-            char_data = self.model.get_discord_members_character_id(str(author.id))
+            char_data = yield from self.model.get_discord_members_character_id(str(author.id))
             character_name, corp_name, character_id = char_data
 
-            yield from self.send_message(author, "Hello {}! You are now authed, your corp is {}!".format(character_name, corp_name))
+            yield from self.send_message(author, "Hello {}! You are now authed, your corp is {}!".format(character_name, corp_name),
+                                         priority=PRIORITY_AUTH)
             yield from self.send_to_debug_channel("User {} just authed as {} (corp {}, char id {}) ".format(str(author.name), character_name, corp_name, character_id))
 
             # assign roles for this user
-            tmproles = self.model.get_roles_for_member(str(author.id))
+            tmproles = yield from self.model.get_roles_for_member(str(author.id))
             logging.info("Member %s will be assigned the following roles: %s", author.name, str(tmproles))
 
             new_roles = [self.roles[str(f)] for f in tmproles]
 
             # get member based on message.author.id
-            member = self.currently_online_members[author.id]
+            member = self.members.get(author.id)
 
             yield from self.add_roles(member, *new_roles)
+
+            # make sure the member is known as authed right away (instead of on the next database poll)
+            yield from self.refresh_member(author.id)
         else:
             logging.error("Could not find token '%s' in database...", auth_token)
-            yield from self.send_message(author, "Sorry, I did not recognize the auth code you sent me!")
+            yield from self.send_message(author, "Sorry, I did not recognize the auth code you sent me!", priority=PRIORITY_AUTH)
             yield from self.send_to_debug_channel("User {} entered auth key {}, but I could not find it in database".format(author.name, auth_token))
 
     @asyncio.coroutine
@@ -238,6 +416,12 @@ class MyDiscordBotClient(discord.Client):
         """Asynchronous event handler that's called every time a message is
         seen by this client (both, private as well as in channel)"""
 
+        if not self.shards.is_primary():
+            # messages are handled by the primary instance, but every shard reports its own progress
+            if message.author.id != self.user.id and parse_command(str(message.content))[0] == "!shard_stats":
+                yield from self.router.dispatch(message, message.channel == self.debug_channel)
+            return
+
         if message.author.id != self.user.id:  # message must not come from yourself
             if "Direct Message" in str(message.channel):
                 logging.info("Private message received from user '%s': '%s'",
@@ -250,7 +434,8 @@ class MyDiscordBotClient(discord.Client):
                                       message.author.name, str(message.author.id))
 
                         yield from self.send_message(message.author,
-                                                     "ERROR: You are trying to auth, but you already authed before...")
+                                                     "ERROR: You are trying to auth, but you already authed before...",
+                                                     priority=PRIORITY_AUTH)
                         yield from self.send_to_debug_channel("ERROR User {} (id: {}) tried to auth twice...".format(message.author, message.author.id))
                     else:
                         logging.info("Auth token received from user '%s' (ID: %s): '%s'", str(message.author), str(message.author.id), str(message.content))
@@ -262,156 +447,141 @@ class MyDiscordBotClient(discord.Client):
                         yield from self.handle_auth_token(message.author, auth_code)
                 else:
                     yield from self.send_message(message.author,
-                                                 "I am sorry, I did not understand what you said.")
+                                                 "I am sorry, I did not understand what you said.",
+                                                 priority=PRIORITY_AUTH)
             else:
                 #logging.info("Message received in channel '" + str(message.channel) + "' from '" + str(message.author) + "': '" + str(message.content) + "'")
                 msg = str(message.content)
-                if str(message.channel) == "just_cookies":
-                    idx = random.randint(0,len(cookie_messages)) % len(cookie_messages)
-                    yield from self.send_message(message.channel, cookie_messages[idx])
-                elif msg.startswith("!reload_commands") and message.channel == self.debug_channel:
-                    logging.info("trying to reload bot commands...")
-                    importlib.reload(bot_commands)
-                    AbstractBotCommand.import_bot_commands(self.model, self)
-                    avail_cmds = " ".join(AbstractBotCommand.available_commands.keys())
-                    yield from self.send_to_debug_channel("Commands reloaded! Available commands: " + avail_cmds)
-                elif msg.startswith("!restart") and message.channel == self.debug_channel:
-                    logging.info("restarting the bot...")
-                    raise KeyboardInterrupt
-                elif msg.startswith("!clear_online_members") and message.channel == self.debug_channel:
-                    logging.info("Trying to clear online users...")
-                    self.clear_online_members()
-                    yield from self.send_to_debug_channel("Cleared currently online members")
-                elif "I LOVE" in msg.upper():
-                    yield from self.send_message(message.channel, "I am sure you do ;) :panda_face: ")
-                elif "I HATE" in msg.upper():
-                    yield from self.send_message(message.channel, "Haters gonna hate!")
-                elif "I DISLIKE" in msg.upper():
-                    yield from self.send_message(message.channel, "I guess that's a valid opionion!")
-                elif "L0L" in msg.upper():
-                    yield from self.send_message(message.channel, ":laughing: :laughing: :laughing: :laughing: :laughing: ")
-                elif msg.startswith("!"):
-                    yield from AbstractBotCommand.handle_msg(message)
-                    # else:
-                    #    logging.debug("Ignoring message, because its from ourselves...")
-
-
-    def get_member_roles(self, member_id):
-        """ returns a list of roles that the member should have """
-        should_have_roles = self.model.get_roles_for_member(member_id)
-
-        ping_start_hour = int(self.authed_users[member_id]['start_hour'])
-        ping_stop_hour = int(self.authed_users[member_id]['stop_hour'])
-
-        cur_hour = datetime.utcnow().hour
-
-        do_time_dep_roles = False
-
-        # case 0: user does not care about any time dependency
-        if ping_start_hour == 0 and ping_stop_hour == 0:
-            do_time_dep_roles = True  # always assign
-        else:
-            # case 1: ping_start_hour < ping_stop_hour, e.g., between 8 and 22 hours
-            if ping_start_hour < ping_stop_hour and cur_hour >= ping_start_hour and cur_hour < ping_stop_hour:
-                do_time_dep_roles = True
+                channel_name = str(message.channel)
+                if msg.startswith("!") and not self.autoresponder.is_catch_all_channel(channel_name):
+                    yield from self.router.dispatch(message, message.channel == self.debug_channel)
+                else:
+                    response = self.autoresponder.get_response(channel_name, msg)
+                    if response is not None:
+                        yield from self.send_message(message.channel, response)
 
-            # case 2: ping_start_hour > ping_stop_hour, e.g., between 16 and 4 hours
-            if ping_start_hour > ping_stop_hour and (cur_hour >= ping_start_hour or cur_hour < ping_stop_hour):
-                do_time_dep_roles = True
 
-        if do_time_dep_roles:
-            for role in should_have_roles:
-                if role in self.timedep_group_assignment:
-                    should_have_roles.append(self.timedep_group_assignment[role])
+    @asyncio.coroutine
+    def reload_commands(self, message, cmd, params):
+        """ admin command: reloads the bot_commands module """
+        logging.info("trying to reload bot commands...")
+        importlib.reload(bot_commands)
+        AbstractBotCommand.import_bot_commands(self.model, self)
+        self.router.clear()
+        AbstractBotCommand.add_routes(self.router)
+        avail_cmds = " ".join(self.router.commands())
+        yield from self.send_to_debug_channel("Commands reloaded! Available commands: " + avail_cmds, urgent=True)
 
-        return should_have_roles
+
+    @asyncio.coroutine
+    def restart(self, message, cmd, params):
+        """ admin command: restarts the bot """
+        logging.info("restarting the bot...")
+        raise KeyboardInterrupt
 
 
     @asyncio.coroutine
-    def verify_member_roles(self, member, member_id):
-        """ checks the roles of a single member, and adds or removes them as needed """
-        try:
-            # which roles should this member have
-            should_have_roles = self.get_member_roles(member_id)
+    def handle_clear_online_members(self, message, cmd, params):
+        """ admin command: clears the list of online members """
+        logging.info("Trying to clear online users...")
+        self.clear_online_members()
+        yield from self.send_to_debug_channel("Cleared currently online members", urgent=True)
 
-            # check if there are any roles that we need to remove
-            roles_to_remove = []
 
-            for role in member.roles:
-                # needs to keep the everyone group
-                if role == self.everyone_group:
-                    continue
-                if str(role.id) not in should_have_roles:
-                    logging.info("Member {} has role {} (ID: {}), but should not have it... removing".format(member.name, role.name, role.id))
-                    roles_to_remove.append(role)
-                else:
-                    should_have_roles.remove(role.id)
+    @asyncio.coroutine
+    def get_member_roles(self, member_id, role_snapshot=None):
+        """ returns the set of role ids that the member should have; uses role_snapshot
+        (see MyDBModel.get_roles_for_all_members) if given, else queries the database """
+        if role_snapshot is not None:
+            should_have_roles = set(role_snapshot.get(member_id, ()))
+        else:
+            should_have_roles = set((yield from self.model.get_roles_for_member(member_id)))
+
+        # is the member within its ping window (see !pingme)?
+        if self.ping_schedule.is_active(member_id):
+            for role in list(should_have_roles):
+                if role in self.timedep_group_assignment:
+                    should_have_roles.add(self.timedep_group_assignment[role])
+
+        return should_have_roles
 
-            # remove those roles if neccessary
-            if len(roles_to_remove) > 0:
-                yield from self.remove_roles(member, *roles_to_remove)
-                yield from asyncio.sleep(0.5)
 
+    @asyncio.coroutine
+    def verify_member_roles(self, member, member_id, role_snapshot=None):
+        """ checks the roles of a single member; if they differ from the roles the
+        member should have, they are replaced with a single API call. Returns True
+        if the roles of the member were changed """
+        try:
+            # which roles should this member have
+            should_have_roles = yield from self.get_member_roles(member_id, role_snapshot)
 
-            roles_to_add = []
-            # anything left in should_have_roles should be assigned
+            desired_role_ids = set()
             for role_id in should_have_roles:
                 # try to find role_id in self.roles
                 if role_id in self.roles:
-                    role = self.roles[role_id]
-                    logging.info("Member {} is missing role {} (ID: {}), adding it now".format(member.name, role.name, role.id))
-                    roles_to_add.append(role)
+                    desired_role_ids.add(role_id)
                 else:
                     logging.error("Member {} is missing role with role_id='{}', tried to add it but I could not find that role... Available roles are: {}".format(member.name, role_id, self.roles.keys()))
                     yield from self.send_to_debug_channel(
                         "Member {} is missing role with role_id='{}', tried to add it but I could not find that role... Available roles are: {}".format(
                             member.name, role_id, self.roles.keys()))
 
-            if len(roles_to_add) > 0:
-                yield from self.add_roles(member, *roles_to_add)
-                yield from asyncio.sleep(0.5)
+            # needs to keep the everyone group, which is never part of the diff
+            current_role_ids = set(str(role.id) for role in member.roles if role != self.everyone_group)
+
+            if current_role_ids == desired_role_ids:
+                return False
+
+            for role_id in current_role_ids - desired_role_ids:
+                logging.info("Member {} has role ID {}, but should not have it... removing".format(member.name, role_id))
+            for role_id in desired_role_ids - current_role_ids:
+                logging.info("Member {} is missing role {} (ID: {}), adding it now".format(member.name, self.roles[role_id].name, role_id))
+
+            yield from self.replace_roles(member, *[self.roles[role_id] for role_id in desired_role_ids])
+            return True
         except:
-            logging.info("Caught an exception in verify_member_roles... Probably rate limited?")
+            # rate limits are handled by self.outbound, so this is a real error
+            logging.info("Caught an exception in verify_member_roles...")
             tb = traceback.format_exc()
             logging.info(str(sys.exc_info()[0]))
             logging.info(tb)
-            yield from asyncio.sleep(3)
+            return False
 
 
     @asyncio.coroutine
     def post_killmail_to_chan(self, external_kill_ID):
         """ Method for forwarding a zkill link to post_expensive_killmails_channel"""
         if self.post_expensive_killmails_channel != None and external_kill_ID != 0:
-            yield from self.send_message(self.post_expensive_killmails_channel, "https://zkillboard.com/kill/" + str(external_kill_ID) + "/")
+            yield from self.send_message(self.post_expensive_killmails_channel, "https://zkillboard.com/kill/" + str(external_kill_ID) + "/",
+                                         priority=PRIORITY_DEBUG)
 
     def forward_zkillboard_expensive_killmails(self):
         logging.info("starting zkillboard forward loop")
 
-        last_id = 0
-
         while True:
             if self.post_expensive_killmails_channel != None:
-                killmail_id = self.model.get_expensive_killmails(last_id)
+                killmail_id = yield from self.model.get_expensive_killmails(self.killmail_last_id)
                 if killmail_id != 0:
                     logging.info("returned killmail_id=" + str(killmail_id))
                     yield from self.post_killmail_to_chan(killmail_id)
-                    last_id = killmail_id
+                    self.killmail_last_id = killmail_id
 
             yield from asyncio.sleep(30)
 
 
     def forward_fleetbot_messages(self):
-        """ Method for forwarding messages to fleetbot channels """
+        """ Method for forwarding messages from the fleetbot ping source to fleetbot channels """
         logging.info("starting forward_fleetbot_messages loop")
         try:
-
-            # store the highest fleetbot message id
-            last_fleetbot_msg_id = self.model.get_fleetbot_max_message_id()
+            yield from self.ping_source.start()
 
             while True:
-                logging.info("Checking if there are new messages to forward for fleetbot")
-                # get up2date messages from database
-                messages = self.model.get_fleetbot_messages(last_fleetbot_msg_id)
+                # do not fetch more messages while the channels are still busy with the last batch
+                while self.fleetbot_fanout.pending() >= self.fleetbot_batch_size:
+                    yield from asyncio.sleep(1)
+
+                # wait for new messages
+                messages = yield from self.ping_source.get_pings()
                 logging.info("Found %d messages with the following keys: %s", len(messages.keys()), str(messages.keys()))
 
                 # go over all groups
@@ -433,129 +603,452 @@ class MyDiscordBotClient(discord.Client):
                     else:
                         logging.info("Error: Could not find group with name '%s' to forward ...", group)
 
-                # update highest fleetbot message id
-                last_fleetbot_msg_id = self.model.get_fleetbot_max_message_id()
-                logging.info("Last Fleetbot message id = " + str(last_fleetbot_msg_id))
-
-                yield from asyncio.sleep(30)
+                logging.info("Last Fleetbot message id = " + str(self.ping_source.last_id))
                 # end while
         except:
             tb = traceback.format_exc()
             logging.info(str(sys.exc_info()[0]))
             logging.info(tb)
 
-            yield from self.send_to_debug_channel("An error happened: " + str(sys.exc_info()[0]) + "\n" + str(tb))
+            yield from self.send_to_debug_channel("An error happened: " + str(sys.exc_info()[0]) + "\n" + str(tb), urgent=True)
 
 
             # also forward this to the debug channel
     # end def forward_fleetbot_messages
 
     def get_sever_member_by_id(self, server, member_id):
-        for member in server.members:
-            if member.id == member_id:
-                return member
-
-        return None
-
-    def verify_users(self, server):
-        """ verify that groups of all users currently online are valid"""
-        logging.info("Start loop: Verifying roles of users")
-
-        while self.do_verify_users:
-            # update list of authed members from database
-            self.authed_users = self.model.get_all_authed_members()
-            #logging.info("Received %s authed users from database", len(self.authed_users))
+        """ returns the member of the main server with member_id, or None """
+        return self.members.get(member_id)
 
-            newOnlineMembers = {}
-            allOnlineMembers = {}
+    def schedule_member_check(self, member_id):
+        """ queues a member for role reconciliation by reconcile_pending_members """
+        if member_id == self.user.id or not self.shards.owns(member_id):
+            return
+        self.pending_member_checks.add(str(member_id))
+        if self.pending_member_event is not None:
+            self.pending_member_event.set()
 
-            number_authed_users = 0
-
-            logging.info("Checking all members that are connected on server (length={})...".format(len(server.members)))
+    def is_main_server_member(self, member):
+        """ returns True if the member belongs to the main server """
+        return member.server is not None and member.server.id == self.main_server_id
 
+    @asyncio.coroutine
+    def on_member_join(self, member):
+        """ a new member joined the server: ask for auth / assign roles right away """
+        if self.is_main_server_member(member):
+            logging.info("Member %s (id=%s) joined the server", member.name, member.id)
+            self.members.add(member)
+            self.schedule_member_check(member.id)
 
-            # iterate over all members:
-            for member in server.members:
-                if member.id == self.user.id:
-                    continue  # skip own bot user
+    @asyncio.coroutine
+    def on_member_update(self, before, after):
+        """ roles or status of a member changed (presence updates without a
+        status change, e.g. a new game, are ignored) """
+        if self.is_main_server_member(after):
+            self.members.update(after)
+            if before.roles != after.roles or before.status != after.status:
+                self.schedule_member_check(after.id)
 
-                #if str(member.status) == 'offline':
-                #    continue # no need to process offline members for now
+    @asyncio.coroutine
+    def on_member_remove(self, member):
+        """ a member left the server, forget about it """
+        if self.is_main_server_member(member):
+            logging.info("Member %s (id=%s) left the server", member.name, member.id)
+            self.members.remove(member.id)
+            self.currently_online_members.discard(str(member.id))
+            self.pending_member_checks.discard(str(member.id))
 
-                member_id = str(member.id)
+    @asyncio.coroutine
+    def refresh_member(self, member_id):
+        """ re-reads auth data and roles of a single member from the database
+        (e.g., after the member authed) and queues the member for reconciliation """
+        member_id = str(member_id)
+        authed_user = yield from self.model.get_authed_member(member_id)
+        if authed_user is not None:
+            self.authed_users[member_id] = authed_user
+            self.ping_schedule.set_window(member_id, authed_user['start_hour'], authed_user['stop_hour'])
+            roles = yield from self.model.get_roles_for_member(member_id)
+            self.member_roles[member_id] = set(roles)
+        else:
+            self.authed_users.pop(member_id, None)
+            self.ping_schedule.remove(member_id)
+            self.member_roles.pop(member_id, None)
+        self.members.mark_authed(member_id, authed_user is not None)
+        self.schedule_member_check(member_id)
 
-                # store in all online members
-                allOnlineMembers[member_id] = member
+    @asyncio.coroutine
+    def refresh_auth_snapshot(self):
+        """ reloads authed members and their roles from the database, and returns
+        the ids of all members whose auth state or roles changed since the last call """
+        changed_ids = set()
+
+        # update list of authed members from database
+        if self.auth_high_water_mark is None:
+            # (re)load all authed members
+            old_authed_users = self.authed_users
+            self.authed_users, self.auth_high_water_mark = yield from self.model.get_authed_members_since(None)
+            for member_id in set(old_authed_users.keys()) | set(self.authed_users.keys()):
+                if old_authed_users.get(member_id) != self.authed_users.get(member_id):
+                    changed_ids.add(member_id)
+            self.members.set_authed(self.authed_users.keys())
+            self.ping_schedule.load(self.authed_users)
+        else:
+            # only the rows which changed since the last refresh
+            changes, self.auth_high_water_mark = yield from self.model.get_authed_members_since(self.auth_high_water_mark)
+            for member_id, authed_user in changes.items():
+                if authed_user != self.authed_users.get(member_id):
+                    changed_ids.add(member_id)
+                    if authed_user is None:
+                        del self.authed_users[member_id]
+                        self.ping_schedule.remove(member_id)
+                    else:
+                        self.authed_users[member_id] = authed_user
+                        self.ping_schedule.set_window(member_id, authed_user['start_hour'], authed_user['stop_hour'])
+                    self.members.mark_authed(member_id, authed_user is not None)
+
+        # and the roles of all authed members in one go
+        old_member_roles = self.member_roles
+        self.member_roles = yield from self.model.get_roles_for_all_members()
+        for member_id in set(old_member_roles.keys()) | set(self.member_roles.keys()):
+            if old_member_roles.get(member_id) != self.member_roles.get(member_id):
+                changed_ids.add(member_id)
+        return changed_ids
 
-                # if this user already known/authed?
-                if member_id in self.authed_users:
-                    number_authed_users += 1
+    @asyncio.coroutine
+    def remove_deleted_auths(self):
+        """ the incremental refresh does not see deleted discord_auth rows: compares
+        the ids of the authed members with the database, forgets the members
+        which are no longer there and returns their ids """
+        authed_ids = yield from self.model.get_authed_member_ids()
+        deleted_ids = set([member_id for member_id in self.authed_users if member_id not in authed_ids])
+        for member_id in deleted_ids:
+            del self.authed_users[member_id]
+            self.ping_schedule.remove(member_id)
+            self.members.mark_authed(member_id, False)
+        if len(deleted_ids) > 0:
+            logging.info("Auth of %d members was deleted", len(deleted_ids))
+        return deleted_ids
+
+    def set_ping_window(self, member_id, start_hour, stop_hour):
+        """ changes the ping window of an authed member right away (the database
+        has to be updated by the caller) """
+        member_id = str(member_id)
+        if member_id in self.authed_users:
+            self.authed_users[member_id]['start_hour'] = start_hour
+            self.authed_users[member_id]['stop_hour'] = stop_hour
+            self.ping_schedule.set_window(member_id, start_hour, stop_hour)
+            self.schedule_member_check(member_id)
 
-                    if member_id not in self.currently_online_members:
-                        logging.info("User %s just connected, already authed!", member.name)
-                        newOnlineMembers[member_id] = member
+    @asyncio.coroutine
+    def update_ping_windows(self):
+        """ at the start of every hour, checks the members whose ping window
+        opens or closes (instead of re-evaluating all windows on every sweep) """
+        while True:
+            now = datetime.utcnow()
+            # wake up just after the hour changed
+            yield from asyncio.sleep(3601 - (now.minute * 60 + now.second + now.microsecond / 1000000.0))
+
+            hour = datetime.utcnow().hour
+            member_ids = [member_id for member_id in self.ping_schedule.transitions_at(hour)
+                          if any(role_id in self.timedep_group_assignment for role_id in self.member_roles.get(member_id, ()))]
+            logging.info("Ping windows of %d members opened or closed at %d:00", len(member_ids), hour)
+            for member_id in member_ids:
+                self.schedule_member_check(member_id)
+
+    def metrics_sources(self):
+        """ returns (label, subsystem) for all subsystems whose metrics() are shown by !db_stats """
+        return [("Database pool", self.db), ("Outbound scheduler", self.outbound), ("Price cache", self.prices),
+                ("Commands", self.router), ("Debug digest", self.debug_digest), ("HTTP client", self.http_client),
+                ("!wiki cache", self.wiki_cache), ("!chuck cache", self.joke_pool), ("!cat cache", self.cat_pool),
+                ("Startup (ms)", self.startup_timer)]
+
+    def get_snapshot_state(self):
+        """ returns the state which survives a restart, as a json serializable dictionary """
+        return {
+            'authed_users': dict(self.authed_users),
+            'member_roles': dict([(member_id, sorted(roles)) for member_id, roles in self.member_roles.items()]),
+            'currently_online_members': sorted(self.currently_online_members),
+            'fleetbot_last_id': self.ping_source.last_id,
+            'fleetbot_last_messages': dict(self.ping_source.last_messages),
+            # the pings after fleetbot_last_id were fetched, but not all of them were sent yet
+            'fleetbot_undelivered': self.fleetbot_fanout.undelivered(),
+            'killmail_last_id': self.killmail_last_id
+        }
+
+    def restore_snapshot_state(self, state):
+        """ restores the state of get_snapshot_state """
+        try:
+            self.authed_users = state['authed_users']
+            # auths may have been deleted while the bot was down, which only a full reload notices
+            self.auth_high_water_mark = None
+            self.member_roles = dict([(member_id, set(roles)) for member_id, roles in state['member_roles'].items()])
+            # these members were already asked to auth, do not ask them again
+            self.currently_online_members = set(state['currently_online_members'])
+            self.killmail_last_id = state['killmail_last_id']
+            age = time.time() - state['saved_at']
+            if age <= self.snapshot_fleetbot_max_age:
+                self.ping_source.last_id = state['fleetbot_last_id']
+                self.ping_source.last_messages = state['fleetbot_last_messages']
+                for channel_id, messages in state['fleetbot_undelivered'].items():
+                    channel = self.main_server.get_channel(channel_id)
+                    if channel is None:
+                        logging.info("Dropping %d undelivered fleetbot messages for unknown channel %s", len(messages), channel_id)
+                        continue
+                    self.fleetbot_fanout.load(channel, messages)
+            else:
+                # the fleetbot continues with the newest pings
+                logging.info("Not restoring the fleetbot position, the snapshot is %d seconds old", age)
+        except (KeyError, TypeError, ValueError):
+            logging.exception("Could not restore snapshot, starting from scratch")
+            self.authed_users = {}
+            self.auth_high_water_mark = None
+            self.member_roles = {}
+            self.currently_online_members = set()
+            self.ping_source.last_id = None
+            self.ping_source.last_messages = {}
+            self.killmail_last_id = 0
+        self.ping_schedule.load(self.authed_users)
+        logging.info("Restored %d authed users from snapshot, fleetbot message id %s, %d undelivered fleetbot messages",
+                     len(self.authed_users), str(self.ping_source.last_id), self.fleetbot_fanout.pending())
+
+    def save_snapshot(self):
+        """ saves the state to snapshot_file (blocking, e.g. on shutdown) """
+        if self.main_server is None:
+            return # we never got ready, keep the last snapshot
+        snapshot.write_snapshot(self.snapshot_file, snapshot.serialize_snapshot(self.get_snapshot_state()))
+        logging.info("Saved snapshot to %s", self.snapshot_file)
 
-                    logging.info("Checking roles for member id={} name={}".format(member_id, member.name))
+    @asyncio.coroutine
+    def save_snapshots(self):
+        """ saves the state every snapshot_interval seconds """
+        loop = asyncio.get_event_loop()
+        while True:
+            yield from asyncio.sleep(self.snapshot_interval)
+            try:
+                state = self.get_snapshot_state()
+                # compressing and writing happens in a thread
+                data = yield from loop.run_in_executor(None, snapshot.serialize_snapshot, state)
+                yield from loop.run_in_executor(None, snapshot.write_snapshot, self.snapshot_file, data)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("Could not save snapshot")
 
-                    # else: we already know this user, user is authed. check for any role updates
-                    yield from self.verify_member_roles(member, member_id)
+    @asyncio.coroutine
+    def auth_maintenance(self):
+        """ every auth_maintenance_interval seconds, makes the next
+        refresh_auth_snapshot reload all authed members (runs on every shard, the
+        incremental refresh does not see deleted rows), and deletes pending auths
+        (only on the primary instance) """
+        while True:
+            yield from asyncio.sleep(self.auth_maintenance_interval)
+            self.auth_high_water_mark = None
+            if not self.shards.is_primary():
+                continue
+            try:
+                deleted = yield from self.model.delete_pending_auths()
+                logging.info("Auth maintenance: deleted %s pending auths", str(deleted))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("Auth maintenance: could not delete pending auths")
 
-                else: # we do not know this user
-                    # make sure this user has no roles (other than everyone)
-                    if len(member.roles) > 1:
-                        logging.info("Found non-authed member %s with roles %s, removing them...", member.name, member.roles)
-                        roles_to_remove = []
-                        for role in member.roles:
-                            if role != self.everyone_group:
-                                roles_to_remove.append(role)
-                        # remove those roles
-                        yield from self.remove_roles(member, *roles_to_remove)
+    @asyncio.coroutine
+    def verify_member(self, member):
+        """ verifies a single member: authed members get their roles checked,
+        non-authed members lose all roles and are asked to auth. Returns True if
+        the roles of the member were changed """
+        if member.id == self.user.id:
+            return False  # skip own bot user
+
+        member_id = str(member.id)
+        is_new_member = member_id not in self.currently_online_members
+        self.currently_online_members.add(member_id)
+
+        # if this user already known/authed?
+        if member_id in self.authed_users:
+            if is_new_member:
+                logging.info("User %s just connected, already authed!", member.name)
+
+            logging.info("Checking roles for member id={} name={}".format(member_id, member.name))
+
+            # else: we already know this user, user is authed. check for any role updates
+            return (yield from self.verify_member_roles(member, member_id, self.member_roles))
+
+        else: # we do not know this user
+            roles_removed = False
+            # make sure this user has no roles (other than everyone)
+            if len(member.roles) > 1:
+                logging.info("Found non-authed member %s with roles %s, removing them...", member.name, member.roles)
+                # remove those roles
+                yield from self.replace_roles(member)
+                roles_removed = True
+
+            # no need to go any further with offline users
+            if str(member.status) == 'offline':
+                return roles_removed
+
+            if is_new_member:
+                logging.info("A new user connected to the server: Name='{}', Status='{}', ID='{}', Server='{}'".format(member.name, member.status, member_id, member.server))
+
+                # this user just got online and is not authed! ask this user to auth
+                try:
+                    yield from self.send_message(member,
+                                                 """Hi! You need to authenticate to be able to use this Discord server. Please go to {} to obtain your authorization token (starting with auth=), and then just message the full token (including auth=) to me!""".format(self.auth_website),
+                                                 priority=PRIORITY_AUTH)
+                except:
+                    logging.info("Got an error while sending message to new user: " + str(sys.exc_info()[0]))
+
+
+                yield from self.send_to_debug_channel("Non authed user {} just connected, asking user to auth...".format(member.name))
+            else:
+                # this user has been online for some time, no need to ask to auth again (I guess)
+                logging.info("Waiting on auth for user: Name='%s', Status='%s', ID='%s', Server='%s'",member.name, member.status, member_id, member.server)
+            return roles_removed
 
-                    # no need to go any further with offline users
-                    if str(member.status) == 'offline':
-                        continue
+    @asyncio.coroutine
+    def verify_member_by_id(self, member_id):
+        """ verifies the member with member_id (see verify_member), if it is still on the server """
+        member = self.members.get(member_id)
+        if member is None:
+            return False
+        return (yield from self.verify_member(member))
 
-                    if member_id not in self.currently_online_members:
-                        logging.info("A new user connected to the server: Name='{}', Status='{}', ID='{}', Server='{}'".format(member.name, member.status, member_id, member.server))
-                        newOnlineMembers[member_id] = member
+    @asyncio.coroutine
+    def reconcile_pending_members(self, server):
+        """ reconciles members queued by gateway events or database changes """
+        logging.info("Start loop: Reconciling members on demand")
 
-                        # this user just got online and is not authed! ask this user to auth
-                        try:
-                            yield from self.send_message(member,
-                                                         """Hi! You need to authenticate to be able to use this Discord server. Please go to {} to obtain your authorization token (starting with auth=), and then just message the full token (including auth=) to me!""".format(self.auth_website))
-                        except:
-                            logging.info("Got an error while sending message to new user: " + sys.exc_info()[0])
+        while True:
+            yield from self.pending_member_event.wait()
+            self.pending_member_event.clear()
 
+            while len(self.pending_member_checks) > 0:
+                member_id = self.pending_member_checks.pop()
+                member = self.get_sever_member_by_id(server, member_id)
+                if member is None:
+                    continue
+                try:
+                    yield from self.verify_member(member)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    # e.g., Forbidden (member ranked above the bot) or a database error,
+                    # the next event or sweep retries this member
+                    logging.exception("Could not reconcile member %s", member_id)
 
-                        yield from self.send_to_debug_channel("Non authed user {} just connected, asking user to auth...".format(member.name))
-                    else:
-                        # this user has been online for some time, no need to ask to auth again (I guess)
-                        logging.info("Waiting on auth for user: Name='%s', Status='%s', ID='%s', Server='%s'",member.name, member.status, member_id, member.server)
+    @asyncio.coroutine
+    def full_sweep(self, server):
+        """ verifies the members of the server which might need an update (safety
+        net for missed events): all authed members, all online members, and all
+        offline members which have roles but are not authed """
+        # rebuild the member index, in case we missed an event
+        self.members.load(server.members, self.authed_users.keys())
+
+        member_ids = self.members.authed | self.members.online
+        member_ids |= set([member_id for member_id in self.members.unauthed - self.members.online
+                           if len(self.members.by_id[member_id].roles) > 1])
+        logging.info("Checking %d of %d members that are connected on server...", len(member_ids), len(self.members))
+
+        # every worker of this instance verifies its part of the members it owns
+        yield from self.shards.run_sweep(member_ids, self.verify_member_by_id)
+
+        # now each member that has been in currently_online_members needs to be checked if still there
+        for member_id in list(self.currently_online_members):
+            if member_id not in self.members:
+                self.currently_online_members.discard(member_id)
+                logging.info("Member %s went offline!", member_id)
 
-            # now each member that has been in currently_online_members needs to be checked if still online
-            for member_id in self.currently_online_members.keys():
-                if member_id not in allOnlineMembers:
-                    member = self.currently_online_members[member_id]
-                    logging.info("Member %s went offline!", member.name)
+    def verify_users(self, server):
+        """ keeps the roles of all users valid: polls the database for changes
+        (new auths, changed group memberships) every db_poll_interval seconds and
+        reconciles only the affected members; every full_sweep_interval seconds
+        all members of the server are verified as a safety net """
+        logging.info("Start loop: Verifying roles of users")
 
-            self.currently_online_members = allOnlineMembers
+        last_full_sweep = 0
 
-            yield from asyncio.sleep(30)
+        while self.do_verify_users:
+            try:
+                changed_member_ids = yield from self.refresh_auth_snapshot()
+
+                if time.time() - last_full_sweep >= self.full_sweep_interval:
+                    last_full_sweep = time.time()
+                    # members whose auth was deleted lose their roles in the sweep
+                    yield from self.remove_deleted_auths()
+                    yield from self.full_sweep(server)
+                else:
+                    if len(changed_member_ids) > 0:
+                        logging.info("Auth data or roles changed for %d members", len(changed_member_ids))
+                    for member_id in changed_member_ids:
+                        self.schedule_member_check(member_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # e.g., the database is not reachable, try again in the next iteration
+                logging.exception("Verifying users failed")
+                yield from self.send_to_debug_channel("Verifying users failed: " + traceback.format_exc())
+
+            yield from asyncio.sleep(self.db_poll_interval)
             # end while
     # end everify users
 
 
     @asyncio.coroutine
-    def send_to_debug_channel(self, msg):
-        """ sends a message to the debug channel """
-        yield from self.send_message(self.debug_channel, "DEBUG: " + msg)
+    def send_to_debug_channel(self, msg, urgent=False):
+        """ sends a message to the debug channel; unless it is urgent, it is
+        buffered and sent with the next digest (see DebugDigest) """
+        if urgent or self.debug_digest_interval <= 0:
+            yield from self.send_message(self.debug_channel, "DEBUG: " + msg, priority=PRIORITY_DEBUG)
+        else:
+            self.debug_digest.add(msg)
 
 
     @asyncio.coroutine
     def send_to_fleetbot_channel(self, group, msg):
-        """ sends a message to a fleetbot channel """
+        """ sends a message to all fleetbot channels of a group (concurrently,
+        the message is queued per channel, see FleetbotFanout) """
         if group in self.group_channels:
             logging.info("send_to_fleetbot_channel: Sending to the following channels: " + str(self.group_channels[group]))
-            for channel in self.group_channels[group]:
-                logging.info("send_to_fleetbot_channel(" + str(group) + ", msg): channel = " + str(channel))
-                yield from self.send_message(channel, msg)
+            self.fleetbot_fanout.broadcast(self.group_channels[group], msg)
+
+
+    def get_message_route(self, destination):
+        """ returns the rate limit route for sending a message to destination """
+        if isinstance(destination, discord.User):
+            # direct message, the private channel might not exist yet
+            return "users/{}/messages".format(destination.id)
+        return "channels/{}/messages".format(destination.id)
+
+
+    @asyncio.coroutine
+    def send_message(self, destination, content=None, priority=DEFAULT_PRIORITY, **kwargs):
+        """ sends a message through the outbound rate limit scheduler; priority
+        is one of the scheduler.PRIORITY_* lanes (default: replies to commands) """
+        return (yield from self.outbound.call(self.get_message_route(destination),
+                                              super(MyDiscordBotClient, self).send_message,
+                                              destination, content, priority=priority, **kwargs))
+
+
+    @asyncio.coroutine
+    def add_roles(self, member, *roles):
+        """ adds roles through the outbound rate limit scheduler """
+        return (yield from self.outbound.call("guilds/{}/members".format(member.server.id),
+                                              super(MyDiscordBotClient, self).add_roles,
+                                              member, *roles, priority=PRIORITY_ROLES))
+
+
+    @asyncio.coroutine
+    def remove_roles(self, member, *roles):
+        """ removes roles through the outbound rate limit scheduler """
+        return (yield from self.outbound.call("guilds/{}/members".format(member.server.id),
+                                              super(MyDiscordBotClient, self).remove_roles,
+                                              member, *roles, priority=PRIORITY_ROLES))
+
+
+    @asyncio.coroutine
+    def replace_roles(self, member, *roles):
+        """ replaces the roles of a member through the outbound rate limit scheduler """
+        return (yield from self.outbound.call("guilds/{}/members".format(member.server.id),
+                                              super(MyDiscordBotClient, self).replace_roles,
+                                              member, *roles, priority=PRIORITY_ROLES))
@@ -0,0 +1,271 @@
+""" Delivery of fleetbot pings to the fleetbot channels """
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+
+
+class FleetbotFanout:
+    """ Delivers fleetbot pings to discord channels. Every channel has its own
+    queue and worker task, so a ping is sent to all of its channels concurrently,
+    while the order of the pings within one channel is kept. A message stays in
+    its queue until it has been sent, so stopping the workers (e.g., on a
+    reconnect) does not lose it. The result of every delivery is recorded per
+    channel in delivery_stats. """
+
+    def __init__(self, send_func):
+        self.send_func = send_func # coroutine function send_func(channel, msg)
+        self.channels = {} # channel id -> channel
+        self.queues = {}   # channel id -> deque of (queued at, msg)
+        self.wakeups = {}  # channel id -> asyncio.Event, set when a message is queued
+        self.workers = {}
+        self.delivery_stats = {}
+
+    def broadcast(self, channels, msg):
+        """ queues msg for delivery to all channels (returns immediately) """
+        now = time.time()
+        for channel in channels:
+            self._get_queue(channel).append((now, msg))
+            self._start_worker(channel.id)
+            self.wakeups[channel.id].set()
+
+    def _get_queue(self, channel):
+        self.channels[channel.id] = channel
+        queue = self.queues.get(channel.id)
+        if queue is None:
+            queue = deque()
+            self.queues[channel.id] = queue
+            self.delivery_stats[channel.id] = {
+                'channel': str(channel),
+                'sent': 0,
+                'failed': 0,
+                'last_latency': 0.0,
+                'last_error': None
+            }
+        return queue
+
+    def _start_worker(self, channel_id):
+        if channel_id not in self.workers:
+            self.wakeups[channel_id] = asyncio.Event()
+            self.workers[channel_id] = asyncio.async(self._deliver(channel_id))
+
+    def start(self, channels):
+        """ (re)starts the workers of all channels with undelivered messages
+        after stop(), using the current channel objects """
+        for channel in channels:
+            if channel.id in self.channels:
+                self.channels[channel.id] = channel
+        for channel_id, queue in self.queues.items():
+            if len(queue) > 0:
+                self._start_worker(channel_id)
+                self.wakeups[channel_id].set()
+
+    def load(self, channel, messages):
+        """ queues messages (list of (queued at, msg), e.g., from undelivered())
+        for channel, they are sent once the workers are started """
+        self._get_queue(channel).extend([(queued_at, msg) for queued_at, msg in messages])
+
+    @asyncio.coroutine
+    def _deliver(self, channel_id):
+        """ worker: sends the queued messages of one channel one after another """
+        queue = self.queues[channel_id]
+        wakeup = self.wakeups[channel_id]
+        stats = self.delivery_stats[channel_id]
+        while True:
+            if len(queue) == 0:
+                wakeup.clear()
+                yield from wakeup.wait()
+                continue
+
+            queued_at, msg = queue[0]
+            channel = self.channels[channel_id]
+            try:
+                yield from self.send_func(channel, msg)
+                stats['sent'] += 1
+                stats['last_latency'] = time.time() - queued_at
+            except asyncio.CancelledError:
+                raise # the message stays queued for the next worker
+            except Exception as e:
+                logging.error("Fleetbot: could not deliver message to channel %s: %s", str(channel), str(e))
+                stats['failed'] += 1
+                stats['last_error'] = str(e)
+            queue.popleft()
+
+    def pending(self):
+        """ returns the number of messages which have not been sent yet """
+        return sum([len(queue) for queue in self.queues.values()])
+
+    def undelivered(self):
+        """ returns the messages which have not been sent yet, as a dictionary
+        channel id -> list of (queued at, msg) """
+        return dict([(channel_id, list(queue)) for channel_id, queue in self.queues.items() if len(queue) > 0])
+
+    def stop(self):
+        """ stops all workers, undelivered messages are kept (see start and undelivered) """
+        for worker in self.workers.values():
+            worker.cancel()
+        self.workers.clear()
+        self.wakeups.clear()
+
+
+def mark_duplicates(messages_by_group, last_messages):
+    """ sets 'forward' to False for every message which repeats the previous
+    message of its group (because fuck spam pings). last_messages holds the last
+    message per group and is updated, so duplicates are also found across batches """
+    duplicates = 0
+    for group in messages_by_group.keys():
+        last_msg = last_messages.get(group, "")
+
+        for msg in messages_by_group[group]:
+            if msg['message'] == last_msg:
+                msg['forward'] = False
+                duplicates += 1
+
+            last_msg = msg['message']
+        last_messages[group] = last_msg
+
+    if duplicates > 0:
+        logging.info("Fleetbot: Found %d duplicates!", duplicates)
+    return messages_by_group
+
+
+class AbstractPingSource:
+    """ A source of fleetbot pings. get_pings() waits for new pings and returns
+    them by group, in the format of MyDBModel.get_fleetbot_messages """
+
+    def __init__(self):
+        self.last_messages = {}
+        self.last_id = None # highest message id seen (if the source knows ids)
+
+    @asyncio.coroutine
+    def start(self):
+        """ prepares the source, called whenever the forward loop (re)starts """
+        pass
+
+    def stop(self):
+        """ releases the resources of the source """
+        pass
+
+    @asyncio.coroutine
+    def get_pings(self):
+        """ waits for new pings and returns a dictionary group -> list of messages """
+        logging.error("Abstract method was called... AbstractPingSource.get_pings")
+        return {}
+
+
+class DatabasePingSource(AbstractPingSource):
+    """ Polls irc_ping_history with an adaptive interval: right after a ping the
+    table is polled every min_interval seconds (fleet pings come in bursts), the
+    interval doubles with every empty poll up to max_interval """
+
+    def __init__(self, model, batch_size=100, min_interval=1, max_interval=10):
+        super(DatabasePingSource, self).__init__()
+        self.model = model
+        self.batch_size = batch_size
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = 0 # first poll happens right away
+
+    @asyncio.coroutine
+    def start(self):
+        if self.last_id is None:
+            # start with the highest fleetbot message id
+            self.last_id = yield from self.model.get_fleetbot_max_message_id()
+            if self.last_id is None:
+                self.last_id = 0
+
+    @asyncio.coroutine
+    def get_pings(self):
+        while True:
+            yield from asyncio.sleep(self.interval)
+            # the new watermark is the highest id we got
+            messages, self.last_id = yield from self.model.get_fleetbot_messages(self.last_id, self.batch_size)
+            msg_cnt = sum([len(msgs) for msgs in messages.values()])
+
+            if msg_cnt > 0:
+                # more pings are likely to follow (or there is a backlog after an
+                # outage, which is drained batch by batch), poll fast
+                self.interval = self.min_interval
+                return mark_duplicates(messages, self.last_messages)
+
+            self.interval = min(max(self.interval * 2, self.min_interval), self.max_interval)
+
+
+class UnixSocketPingSource(AbstractPingSource):
+    """ Push source: listens on a unix socket, to which the IRC relay writes one
+    JSON object per line, e.g.
+    {"id": 1234, "groupname": "BC/SUPERS", "from": "Sako", "message": "form up"}
+    The id is optional and only used to keep track of the watermark. """
+
+    def __init__(self, path):
+        super(UnixSocketPingSource, self).__init__()
+        self.path = path
+        self.queue = None
+        self.server = None
+
+    @asyncio.coroutine
+    def start(self):
+        if self.server is not None:
+            return
+        self.queue = asyncio.Queue()
+        if os.path.exists(self.path):
+            os.remove(self.path) # stale socket of a previous run
+        self.server = yield from asyncio.start_unix_server(self.handle_connection, path=self.path)
+        logging.info("Fleetbot: listening for pings on %s", self.path)
+
+    def stop(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+
+    @asyncio.coroutine
+    def handle_connection(self, reader, writer):
+        """ reads pings (one JSON object per line) from a relay connection """
+        try:
+            while True:
+                line = yield from reader.readline()
+                if not line:
+                    break
+                try:
+                    data = json.loads(line.decode('utf-8'))
+                    ping_id = data.get('id')
+                    self.queue.put_nowait({
+                        'id': int(ping_id) if ping_id is not None else None,
+                        'group': data['groupname'],
+                        'from': data['from'],
+                        'timestamp': data.get('timestamp'),
+                        'message': data['message'],
+                        'forward': True
+                    })
+                except (ValueError, TypeError, KeyError, AttributeError):
+                    logging.error("Fleetbot: ignoring malformed ping %s", str(line))
+        finally:
+            writer.close()
+
+    @asyncio.coroutine
+    def get_pings(self):
+        # wait for one ping, then take everything else that arrived in the meantime
+        pings = [(yield from self.queue.get())]
+        while not self.queue.empty():
+            pings.append(self.queue.get_nowait())
+
+        messages_by_group = {}
+        for ping in pings:
+            if ping['id'] is not None:
+                self.last_id = max(self.last_id or 0, ping['id'])
+            group = ping.pop('group')
+            if group not in messages_by_group:
+                messages_by_group[group] = []
+            messages_by_group[group].append(ping)
+        return mark_duplicates(messages_by_group, self.last_messages)
+
+
+def create_ping_source(spec, model, batch_size=100, min_interval=1, max_interval=10):
+    """ creates the ping source described by spec: "db" polls the database,
+    "unix:/path/to/socket" listens on a unix socket """
+    if spec.startswith("unix:"):
+        return UnixSocketPingSource(spec[len("unix:"):])
+    return DatabasePingSource(model, batch_size, min_interval, max_interval)
@@ -0,0 +1,137 @@
+""" Shared asynchronous HTTP client for bot commands which query external APIs
+(icndb, thecatapi, wikipedia, ...) """
+
+import asyncio
+import json
+import logging
+import time
+import urllib.parse
+
+import aiohttp
+
+
+class HTTPClientError(Exception):
+    """ Raised if a request failed (after all retries) """
+    pass
+
+
+class AsyncHTTPClient:
+    """ Wraps one aiohttp.ClientSession, so connections to the same host are kept
+    alive and reused. At most per_host_limit requests run against a host at the
+    same time (others wait for their turn, which does not count towards the
+    timeout). Requests which time out, fail to connect or get a 5xx response
+    are retried up to retries times with an increasing delay. """
+
+    def __init__(self, loop=None, timeout=10, retries=2, retry_delay=0.5, per_host_limit=4,
+                 keepalive_timeout=30, user_agent="PyDiscordBot"):
+        self.loop = loop
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.per_host_limit = per_host_limit
+        self.keepalive_timeout = keepalive_timeout
+        self.headers = {'User-Agent': user_agent}
+
+        self.session = None
+        self.host_semaphores = {}
+
+        # metrics
+        self.requests = 0
+        self.retried = 0
+        self.failed = 0
+        self.total_time = 0.0
+
+    def get_session(self):
+        """ returns the aiohttp session (created on first use, so it belongs to the running loop) """
+        if self.session is None or self.session.closed:
+            loop = self.loop if self.loop is not None else asyncio.get_event_loop()
+            connector = aiohttp.TCPConnector(limit=self.per_host_limit,
+                                             keepalive_timeout=self.keepalive_timeout,
+                                             loop=loop)
+            self.session = aiohttp.ClientSession(connector=connector, headers=self.headers, loop=loop)
+        return self.session
+
+    def get_semaphore(self, host):
+        semaphore = self.host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.per_host_limit)
+            self.host_semaphores[host] = semaphore
+        return semaphore
+
+    @asyncio.coroutine
+    def request(self, method, url, params=None):
+        """ makes a request and reads the response, returns (status, final url, body as bytes) """
+        host = urllib.parse.urlsplit(url).netloc
+        semaphore = self.get_semaphore(host)
+        start = time.time()
+        self.requests += 1
+
+        attempt = 0
+        while True:
+            yield from semaphore.acquire()
+            try:
+                with aiohttp.Timeout(self.timeout, loop=self.loop):
+                    response = yield from self.get_session().request(method, url, params=params)
+                    try:
+                        body = yield from response.read()
+                    finally:
+                        # hands the connection back to the pool for keep-alive
+                        yield from response.release()
+
+                if response.status < 500:
+                    self.total_time += time.time() - start
+                    return response.status, str(response.url), body
+                error = "HTTP status {}".format(response.status)
+            except (aiohttp.ClientError, aiohttp.DisconnectedError, asyncio.TimeoutError, OSError) as e:
+                error = "{}: {}".format(type(e).__name__, e)
+            finally:
+                semaphore.release()
+
+            if attempt >= self.retries:
+                self.failed += 1
+                self.total_time += time.time() - start
+                logging.info("AsyncHTTPClient: %s %s failed: %s", method, url, error)
+                raise HTTPClientError("{} {} failed: {}".format(method, url, error))
+
+            attempt += 1
+            self.retried += 1
+            logging.debug("AsyncHTTPClient: %s %s failed (%s), retry %d", method, url, error, attempt)
+            yield from asyncio.sleep(self.retry_delay * attempt)
+
+    @asyncio.coroutine
+    def get(self, url, params=None):
+        """ GET request, returns (status, final url, body as bytes); raises HTTPClientError
+        for 4xx responses """
+        status, final_url, body = yield from self.request("GET", url, params)
+        if status >= 400:
+            raise HTTPClientError("GET {} failed: HTTP status {}".format(url, status))
+        return status, final_url, body
+
+    @asyncio.coroutine
+    def get_json(self, url, params=None):
+        """ GET request, returns the decoded json response """
+        status, final_url, body = yield from self.get(url, params)
+        try:
+            return json.loads(body.decode())
+        except ValueError as e:
+            raise HTTPClientError("GET {} returned invalid json: {}".format(url, e))
+
+    @asyncio.coroutine
+    def get_final_url(self, url, params=None):
+        """ GET request, returns the url after following all redirects """
+        status, final_url, body = yield from self.get(url, params)
+        return final_url
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+    def metrics(self):
+        """ returns a dictionary with request statistics """
+        return {
+            'requests': self.requests,
+            'retried': self.retried,
+            'failed': self.failed,
+            'avg_time_ms': round(1000.0 * self.total_time / self.requests, 2) if self.requests > 0 else 0.0
+        }
@@ -0,0 +1,88 @@
+""" Index of the members of the main server, kept up to date from gateway events """
+
+
+class MemberIndex:
+    """ Members of a server by id, with the ids of online, authed and unauthed
+    members as sets, so that lookups are O(1) and loops can iterate just the
+    members they care about. Kept up to date by the member join/update/remove
+    events (add, update, remove) and by the auth data from the database
+    (set_authed, mark_authed). """
+
+    def __init__(self):
+        self.by_id = {}
+        self.online = set()
+        self.authed = set()
+        self.unauthed = set()
+        self.authed_ids = set() # all authed ids, including members which are not on the server
+
+    def load(self, members, authed_ids=None):
+        """ rebuilds the index from a list of members (e.g., server.members) """
+        if authed_ids is not None:
+            self.authed_ids = set(str(member_id) for member_id in authed_ids)
+        self.by_id = {}
+        self.online = set()
+        self.authed = set()
+        self.unauthed = set()
+        for member in members:
+            self.add(member)
+
+    def add(self, member):
+        """ adds (or updates) a member """
+        member_id = str(member.id)
+        self.by_id[member_id] = member
+        if str(member.status) != 'offline':
+            self.online.add(member_id)
+        else:
+            self.online.discard(member_id)
+        if member_id in self.authed_ids:
+            self.authed.add(member_id)
+            self.unauthed.discard(member_id)
+        else:
+            self.unauthed.add(member_id)
+            self.authed.discard(member_id)
+
+    update = add
+
+    def remove(self, member_id):
+        """ removes a member (e.g., the member left the server) """
+        member_id = str(member_id)
+        self.by_id.pop(member_id, None)
+        self.online.discard(member_id)
+        self.authed.discard(member_id)
+        self.unauthed.discard(member_id)
+
+    def get(self, member_id):
+        """ returns the member with member_id, or None """
+        return self.by_id.get(str(member_id))
+
+    def mark_authed(self, member_id, is_authed):
+        """ updates the auth state of a single member """
+        member_id = str(member_id)
+        if is_authed:
+            self.authed_ids.add(member_id)
+        else:
+            self.authed_ids.discard(member_id)
+
+        if member_id in self.by_id:
+            if is_authed:
+                self.authed.add(member_id)
+                self.unauthed.discard(member_id)
+            else:
+                self.unauthed.add(member_id)
+                self.authed.discard(member_id)
+
+    def set_authed(self, authed_ids):
+        """ replaces the set of authed member ids (e.g., after reloading them from the database) """
+        self.authed_ids = set(str(member_id) for member_id in authed_ids)
+        self.authed = set([member_id for member_id in self.by_id if member_id in self.authed_ids])
+        self.unauthed = set(self.by_id.keys()) - self.authed
+
+    def members(self, member_ids):
+        """ returns the members with the given ids (ids which are not in the index are skipped) """
+        return [self.by_id[member_id] for member_id in member_ids if member_id in self.by_id]
+
+    def __contains__(self, member_id):
+        return str(member_id) in self.by_id
+
+    def __len__(self):
+        return len(self.by_id)
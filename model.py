@@ -3,41 +3,252 @@ import pymysql.cursors
 import pymysql.connections
 
 import logging
+import asyncio
+import time
+import threading
+import functools
+import contextlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+# MySQL client errors which mean the connection is dead and has to be replaced:
+# 2006 = MySQL server has gone away, 2013 = Lost connection to MySQL server during query
+RECONNECT_ERRNOS = (2006, 2013)
+
+
+def is_disconnect_error(e):
+    """ returns True if the pymysql exception e signals a lost connection """
+    return isinstance(e, pymysql.OperationalError) and len(e.args) > 0 and e.args[0] in RECONNECT_ERRNOS
+
+
+class PoolTimeoutError(Exception):
+    """ raised if no connection could be checked out of the pool in time """
+    pass
+
+
+class PooledConnection:
+    """ a pymysql connection plus the bookkeeping the pool needs """
+    __slots__ = ('conn', 'created', 'last_used')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created = time.time()
+        self.last_used = self.created
+
+
+class ConnectionPool:
+    """ A thread-safe pool of pymysql connections.
+
+    Connections are handed out with ``with pool.connection() as db:``. Idle
+    connections are pinged before re-use only if they have not been used for
+    ping_interval seconds, connections older than max_lifetime seconds are
+    recycled, and connections which fail with errno 2006/2013 are discarded
+    (MyDBModel then retries the query on a fresh connection). """
+
+    def __init__(self, connect_kwargs, min_size=1, max_size=4, ping_interval=60,
+                 max_lifetime=3600, checkout_timeout=30):
+        self.connect_kwargs = connect_kwargs
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.ping_interval = ping_interval
+        self.max_lifetime = max_lifetime
+        self.checkout_timeout = checkout_timeout
+
+        self._idle = deque()
+        self._size = 0 # number of open connections (idle + checked out)
+        self._cond = threading.Condition()
+
+        # metrics
+        self.checked_out = 0
+        self.checkouts = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.reconnects = 0
+        self.pings = 0
+        self.recycled = 0
+
+        for i in range(min(min_size, self.max_size)):
+            self._idle.append(self._open())
+            self._size += 1
+
+    def _open(self):
+        """ opens a new pymysql connection """
+        logging.debug("ConnectionPool: opening new database connection")
+        return PooledConnection(pymysql.connect(**self.connect_kwargs))
+
+    def _close(self, entry):
+        try:
+            entry.conn.close()
+        except pymysql.Error:
+            pass
+
+    def _validate(self, entry):
+        """ makes sure a connection taken from the idle list is usable, returns
+        the (possibly new) entry """
+        now = time.time()
+        if now - entry.created > self.max_lifetime:
+            logging.debug("ConnectionPool: recycling connection after %d seconds", now - entry.created)
+            self._close(entry)
+            self.recycled += 1
+            return self._open()
+
+        if now - entry.last_used > self.ping_interval:
+            self.pings += 1
+            try:
+                entry.conn.ping(reconnect=False)
+            except pymysql.Error:
+                logging.error("ConnectionPool: idle connection is dead, reconnecting")
+                self._close(entry)
+                self.reconnects += 1
+                return self._open()
+        return entry
+
+    def acquire(self):
+        """ checks out a connection, blocks for up to checkout_timeout seconds
+        if max_size connections are in use """
+        start = time.time()
+        entry = None
+        with self._cond:
+            while True:
+                if len(self._idle) > 0:
+                    entry = self._idle.pop() # LIFO, keeps the hot connections warm
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = self.checkout_timeout - (time.time() - start)
+                if remaining <= 0:
+                    raise PoolTimeoutError("No database connection available after {} seconds".format(self.checkout_timeout))
+                self._cond.wait(remaining)
+            self.checked_out += 1
+
+        try:
+            if entry is None:
+                entry = self._open()
+            else:
+                entry = self._validate(entry)
+        except:
+            with self._cond:
+                self._size -= 1
+                self.checked_out -= 1
+                self._cond.notify()
+            raise
+
+        waited = time.time() - start
+        with self._cond:
+            self.checkouts += 1
+            self.total_wait_time += waited
+            self.max_wait_time = max(self.max_wait_time, waited)
+        return entry
+
+    def release(self, entry, discard=False):
+        """ returns a connection to the pool, or closes it if discard is set """
+        if discard:
+            self._close(entry)
+        else:
+            entry.last_used = time.time()
+        with self._cond:
+            self.checked_out -= 1
+            if discard:
+                self._size -= 1
+                # the server may have dropped the other idle connections as well,
+                # make sure they are pinged before they are used the next time
+                for other in self._idle:
+                    other.last_used = 0
+            else:
+                self._idle.append(entry)
+            self._cond.notify()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """ context manager which checks out a connection and returns it afterwards """
+        entry = self.acquire()
+        try:
+            yield entry.conn
+        except Exception as e:
+            if is_disconnect_error(e):
+                self.release(entry, discard=True)
+            else:
+                try:
+                    entry.conn.rollback()
+                    self.release(entry)
+                except pymysql.Error:
+                    self.release(entry, discard=True)
+            raise
+        else:
+            self.release(entry)
+
+    def close(self):
+        """ closes all idle connections """
+        with self._cond:
+            while len(self._idle) > 0:
+                self._close(self._idle.pop())
+                self._size -= 1
+
+    def metrics(self):
+        """ returns a dictionary with pool statistics """
+        with self._cond:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'checked_out': self.checked_out,
+                'max_size': self.max_size,
+                'checkouts': self.checkouts,
+                'avg_wait_ms': round(1000.0 * self.total_wait_time / self.checkouts, 2) if self.checkouts > 0 else 0.0,
+                'max_wait_ms': round(1000.0 * self.max_wait_time, 2),
+                'reconnects': self.reconnects,
+                'pings': self.pings,
+                'recycled': self.recycled
+            }
+
+
+def reconnect_on_disconnect(func):
+    """ decorator for MyDBModel methods: if the query fails because the
+    connection was lost (errno 2006/2013), retry it once on a fresh connection """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return func(self, *args, **kwargs)
+        except pymysql.OperationalError as e:
+            if not is_disconnect_error(e):
+                raise
+            logging.error("Database connection lost in %s (%s), retrying once", func.__name__, str(e))
+            self.pool.reconnects += 1
+            return func(self, *args, **kwargs)
+    return wrapper
+
 
 class MyDBModel:
     """ Database model which holds several get / set methods"""
 
-    def __init__(self, db):
-        self.db = db # the database
+    def __init__(self, pool):
+        self.pool = pool # the database connection pool
 
+    @reconnect_on_disconnect
     def check_db_connection(self):
         sq = "SELECT NOW()"
-        with self.db.cursor() as cursor:
-            try:
-                cursor.execute( sq )
-            except pymysql.Error as e:
-                if e.errno == 2006:
-                    logging.error("Database connection failed, trying to reconnect")
-                    return self.db.connect()
-                else:
-                    logging.error("Database connection failed... could not connect to database...")
-                    return False
+        with self.pool.connection() as db, db.cursor() as cursor:
+            cursor.execute( sq )
+            return True
 
+    @reconnect_on_disconnect
     def set_discord_member_id_for_auth_code(self, auth_code, member_id):
         """ establish relation ship between discord member and auth token"""
         logging.debug("set_discord_member_id_for_auth_code({}, {})". format(auth_code, member_id))
 
-        with self.db.cursor() as cursor:
+        with self.pool.connection() as db, db.cursor() as cursor:
             # Read a single record
             sql = "UPDATE discord_auth SET discord_member_id = %s WHERE discord_auth_token=%s AND discord_member_id = '' "
             cursor.execute(sql, (member_id, auth_code,))
             cursor.close()
-            self.db.commit()
+            db.commit()
 
 
+    @reconnect_on_disconnect
     def get_roles_for_member(self, member_id):
         """ returns an array of discord group IDs for a certain member """
-        with self.db.cursor() as cursor:
+        with self.pool.connection() as db, db.cursor() as cursor:
             sql = """SELECT discord_group_id
             FROM groups g, group_membership m, discord_auth a
             WHERE a.discord_member_id=%s AND g.group_id = m.group_id
@@ -54,8 +265,33 @@ class MyDBModel:
         return []
 
 
+    @reconnect_on_disconnect
+    def get_roles_for_all_members(self):
+        """ returns a dictionary which maps every authed discord member id to the
+        set of discord group IDs that member should have (one query for all members) """
+        with self.pool.connection() as db, db.cursor() as cursor:
+            sql = """SELECT a.discord_member_id, g.discord_group_id
+            FROM groups g, group_membership m, discord_auth a
+            WHERE g.group_id = m.group_id
+            AND m.state <= 1
+            AND m.user_id = a.user_id AND g.discord_group_id != 0
+            AND a.discord_member_id IS NOT NULL AND a.discord_member_id <> ''"""
+            cursor.execute(sql)
+
+            roles_by_member = {}
+            for row in cursor:
+                member_id = str(row['discord_member_id'])
+                if member_id not in roles_by_member:
+                    roles_by_member[member_id] = set()
+                roles_by_member[member_id].add(str(row['discord_group_id']))
+            cursor.close()
+            return roles_by_member
+        return {}
+
+
+    @reconnect_on_disconnect
     def is_auth_code_in_table(self, auth_code):
-        with self.db.cursor() as cursor:
+        with self.pool.connection() as db, db.cursor() as cursor:
             # Read a single record
             sql = "SELECT COUNT(*) as cnt_authed from discord_auth WHERE discord_auth_token=%s AND discord_member_id = '' "
             cursor.execute(sql, (auth_code,))
@@ -72,9 +308,10 @@ class MyDBModel:
         return False
 
 
+    @reconnect_on_disconnect
     def get_discord_members_number_of_kills(self, member_id):
         """ returns characters name, corporation name, character id based on the member id"""
-        with self.db.cursor() as cursor:
+        with self.pool.connection() as db, db.cursor() as cursor:
             sql = """SELECT SUM(s.number_kills) as number_kills
             FROM discord_auth a, auth_users b, api_characters c, kills_stats_per_char s
             WHERE a.user_id = b.user_id AND b.user_id = c.user_id AND c.character_id = s.character_id
@@ -88,9 +325,10 @@ class MyDBModel:
         return 0
 
 
+    @reconnect_on_disconnect
     def get_discord_members_character_id(self, member_id):
         """ returns characters name, corporation name, character id based on the member id"""
-        with self.db.cursor() as cursor:
+        with self.pool.connection() as db, db.cursor() as cursor:
             sql = """SELECT c.corp_name, c.character_name, c.character_id from discord_auth a, auth_users b, api_characters c
             WHERE a.user_id = b.user_id AND b.user_id = c.user_id AND c.character_id = b.has_regged_main
             AND a.discord_member_id = %s"""
@@ -103,52 +341,120 @@ class MyDBModel:
         return "Unknown", -1, -1
 
 
-    def get_all_authed_members(self):
-        """ returns a list of all authed members as dictionaries """
-        self.check_db_connection()
-
-        with self.db.cursor() as cursor:
-            # first, delete all "pending auth users"
+    @reconnect_on_disconnect
+    def delete_pending_auths(self):
+        """ deletes all "pending auth users" (rows without auth token), returns the number of deleted rows """
+        with self.pool.connection() as db, db.cursor() as cursor:
             sql = """DELETE FROM discord_auth WHERE discord_auth_token = ''"""
-            cursor.execute(sql)
-            self.db.commit()
+            deleted = cursor.execute(sql)
+            db.commit()
+            cursor.close()
+            return deleted
+        return 0
 
+    def get_all_authed_members(self):
+        """ returns a list of all authed members as dictionaries """
+        authed_users, high_water_mark = self.get_authed_members_since(None)
+        return authed_users
+
+    @reconnect_on_disconnect
+    def get_authed_members_since(self, since=None):
+        """ returns the auth data of members whose discord_auth row changed at or
+        after since (a last_updated timestamp, None for all members), and the
+        newest last_updated value as the high-water mark for the next call.
+        The auth data is a dictionary member id -> dictionary (like
+        get_all_authed_members); if since is given, members whose row is no
+        longer authed map to None. """
+        with self.pool.connection() as db, db.cursor() as cursor:
             sql = """SELECT user_id, discord_member_id, discord_auth_token,
-            ping_start_hour, ping_stop_hour
+            ping_start_hour, ping_stop_hour, last_updated
             FROM discord_auth
-            WHERE discord_auth_token <> ''
-            AND discord_member_id  IS NOT NULL; """
-
-            cursor.execute(sql)
+            WHERE discord_member_id IS NOT NULL """
+            if since is None:
+                sql += "AND discord_auth_token <> '' "
+                cursor.execute(sql)
+            else:
+                # >= instead of >, rows changed within the same second as since are read again
+                sql += "AND last_updated >= %s ORDER BY last_updated"
+                cursor.execute(sql, (since,))
 
             authed_users = {}
+            high_water_mark = since
 
             for row in cursor:
-                authed_users[str(row['discord_member_id'])] = {
-                    'user_id': row['user_id'],
-                    'auth_token': row['discord_auth_token'],
-                    'start_hour': row['ping_start_hour'],
-                    'stop_hour': row['ping_stop_hour']
-                }
+                if row['discord_auth_token'] != '':
+                    authed_users[str(row['discord_member_id'])] = {
+                        'user_id': row['user_id'],
+                        'auth_token': row['discord_auth_token'],
+                        'start_hour': row['ping_start_hour'],
+                        'stop_hour': row['ping_stop_hour']
+                    }
+                elif str(row['discord_member_id']) not in authed_users:
+                    authed_users[str(row['discord_member_id'])] = None
+                if high_water_mark is None or row['last_updated'] > high_water_mark:
+                    high_water_mark = row['last_updated']
             cursor.close()
 
-            return authed_users
-        return {}
+            return authed_users, high_water_mark
+        return {}, since
+
+    @reconnect_on_disconnect
+    def get_authed_member_ids(self):
+        """ returns the set of discord member ids of all authed members (cheap, to
+        find members whose discord_auth row was deleted) """
+        with self.pool.connection() as db, db.cursor() as cursor:
+            sql = """SELECT discord_member_id
+            FROM discord_auth
+            WHERE discord_member_id IS NOT NULL
+            AND discord_auth_token <> ''"""
 
+            cursor.execute(sql)
+            member_ids = set([str(row['discord_member_id']) for row in cursor])
+            cursor.close()
+            return member_ids
+        return set()
+
+    @reconnect_on_disconnect
+    def get_authed_member(self, member_id):
+        """ returns the auth data of a single authed member (same format as the
+        entries of get_all_authed_members) or None """
+        with self.pool.connection() as db, db.cursor() as cursor:
+            sql = """SELECT user_id, discord_member_id, discord_auth_token,
+            ping_start_hour, ping_stop_hour
+            FROM discord_auth
+            WHERE discord_auth_token <> ''
+            AND discord_member_id = %s"""
+
+            cursor.execute(sql, (str(member_id),))
+            row = cursor.fetchone()
+            cursor.close()
+
+            if row is None:
+                return None
+            return {
+                'user_id': row['user_id'],
+                'auth_token': row['discord_auth_token'],
+                'start_hour': row['ping_start_hour'],
+                'stop_hour': row['ping_stop_hour']
+            }
+        return None
+
+    @reconnect_on_disconnect
     def update_ping_start_stop_hour(self, discord_member_id, start_hour, stop_hour):
         """ updates discord_auth.ping_start_hour and ping_stop_hour """
-        with self.db.cursor() as cursor:
+        with self.pool.connection() as db, db.cursor() as cursor:
             sql = """UPDATE discord_auth SET ping_start_hour = %s, ping_stop_hour = %s
             WHERE discord_member_id = %s"""
 
             cursor.execute(sql, (str(start_hour), str(stop_hour), str(discord_member_id),))
             cursor.close()
 
-            self.db.commit()
+            db.commit()
 
+    @reconnect_on_disconnect
     def get_fleetbot_max_message_id(self):
         """ returns the last max message id from fleetbot messages """
-        with self.db.cursor() as cursor:
+        with self.pool.connection() as db, db.cursor() as cursor:
             sql = """SELECT max(id) as max_id FROM irc_ping_history """
             cursor.execute(sql)
 
@@ -159,6 +465,7 @@ class MyDBModel:
         return 0
 
 
+    @reconnect_on_disconnect
     def find_pos(self, solar_system_id=None):
         """ Returns a list of POSes in that system """
 
@@ -175,7 +482,7 @@ class MyDBModel:
         if solar_system_id != None:
             sql += " AND s.locationID = " + str(solar_system_id)
 
-        with self.db.cursor() as cursor:
+        with self.pool.connection() as db, db.cursor() as cursor:
             number = cursor.execute(sql)
             starbases = {}
             if number > 0:
@@ -192,32 +499,51 @@ class MyDBModel:
                 return {}
 
 
-    def find_system(self, system_str):
-        """ Returns a system and region name based on system_str (partial) """
-        system_str = system_str + "%"
+    @reconnect_on_disconnect
+    def get_all_solar_systems(self):
+        """ Returns a list of all solar systems (with region name), see staticdata """
         sql = """SELECT regionName, solarSystemID, solarSystemName
             FROM eve_staticdata.mapSolarSystems s, eve_staticdata.mapRegions r
-            WHERE r.regionID = s.regionID and `solarSystemName` LIKE %s"""
-        with self.db.cursor() as cursor:
-            number = cursor.execute(sql, (system_str,))
-            if number == 1:
-                result = cursor.fetchone()
-                cursor.close()
-                return {'regionName': result['regionName'], 'solarSystemID': result['solarSystemID'], 'solarSystemName': result['solarSystemName']}
-            elif number == 0:
-                cursor.close()
-                return None
-            else:
-                system_names = []
-                for row in cursor:
-                    system_names.append(row['solarSystemName'] + " (" + row['regionName'] + ")")
-                cursor.close()
-                return system_names
+            WHERE r.regionID = s.regionID"""
+        with self.pool.connection() as db, db.cursor() as cursor:
+            cursor.execute(sql)
+            systems = []
+            for row in cursor:
+                systems.append({'regionName': row['regionName'], 'solarSystemID': row['solarSystemID'], 'solarSystemName': row['solarSystemName']})
+            cursor.close()
+            return systems
 
+    @reconnect_on_disconnect
+    def get_all_published_items(self):
+        """ Returns a list of all published items, see staticdata """
+        sql = """SELECT typeName, typeID, description
+            FROM eve_staticdata.invTypes
+            WHERE published=1"""
+        with self.pool.connection() as db, db.cursor() as cursor:
+            cursor.execute(sql)
+            items = []
+            for row in cursor:
+                items.append({'id': row['typeID'], 'name': row['typeName'], 'description': row['description']})
+            cursor.close()
+            return items
+
+    @reconnect_on_disconnect
+    def get_all_prices(self):
+        """ Returns a dictionary type id -> sell price of all items in the prices table """
+        sql = """SELECT type_id, sell FROM prices"""
+        with self.pool.connection() as db, db.cursor() as cursor:
+            cursor.execute(sql)
+            prices = {}
+            for row in cursor:
+                prices[row['type_id']] = row['sell']
+            cursor.close()
+            return prices
+
+    @reconnect_on_disconnect
     def get_item_price(self, item_type_id):
         """ REturns the price (if it is in database) """
         sql = """SELECT sell FROM prices WHERE type_id=%s"""
-        with self.db.cursor() as cursor:
+        with self.pool.connection() as db, db.cursor() as cursor:
             number = cursor.execute(sql, (item_type_id,))
             if number == 1:
                 result = cursor.fetchone()
@@ -229,34 +555,7 @@ class MyDBModel:
 
 
 
-    def find_item(self, item_str):
-        """ Returns info about item """
-        orig_item_str = item_str
-        item_str = "%" + item_str + "%"
-        sql = """SELECT typeName, typeID, description
-            FROM eve_staticdata.invTypes
-            WHERE published=1 AND typeName LIKE %s ORDER BY typename ASC LIMIT 0,5"""
-        with self.db.cursor() as cursor:
-            number = cursor.execute(sql, (item_str,))
-            if number == 1:
-                result = cursor.fetchone()
-                cursor.close()
-                return {'id': result['typeID'], 'name': result['typeName'], 'description': result['description']}
-            elif number == 0:
-                cursor.close()
-                return None
-            else:
-                item_list = []
-                for row in cursor:
-                    if row['typeName'].lower() == orig_item_str.lower():
-                        cursor.close()
-                        return {'id': row['typeID'], 'name': row['typeName'], 'description': row['description']}
-
-                    item_list.append(row['typeName'])
-                cursor.close()
-                return item_list
-
-
+    @reconnect_on_disconnect
     def get_expensive_killmails(self, last_id=0):
         """ returns the most expensive kill within the last 3 hours """
         sql = """SELECT external_kill_ID
@@ -265,7 +564,7 @@ class MyDBModel:
             AND TIMESTAMPDIFF(HOUR,kill_time, now()) < 3
             ORDER BY kill_time DESC
             LIMIT 0 , 1"""
-        with self.db.cursor() as cursor:
+        with self.pool.connection() as db, db.cursor() as cursor:
             cursor.execute(sql, (str(last_id),))
             try:
                 result = cursor.fetchone()
@@ -275,18 +574,22 @@ class MyDBModel:
         return 0
 
 
-    def get_fleetbot_messages(self, last_id=0):
-        """ returns a list of fleetbot messages by group """
-        with self.db.cursor() as cursor:
+    @reconnect_on_disconnect
+    def get_fleetbot_messages(self, last_id=0, limit=100):
+        """ returns the (at most limit) fleetbot messages after last_id by group,
+        and the highest message id that was fetched (the new watermark) """
+        with self.pool.connection() as db, db.cursor() as cursor:
             sql = """SELECT id, from_character, `timestamp`, message, groupname
-            FROM irc_ping_history WHERE id > %s ORDER BY `timestamp` ASC """
-            cursor.execute(sql, (str(last_id),))
+            FROM irc_ping_history WHERE id > %s ORDER BY id ASC LIMIT %s"""
+            cursor.execute(sql, (int(last_id), int(limit),))
 
             messages_by_group = {}
 
             msg_cnt = 0
+            max_id = last_id
 
             for row in cursor:
+                max_id = max(max_id, row['id'])
                 group = row['groupname']
                 if group not in messages_by_group:
                     messages_by_group[group] = []
@@ -307,22 +610,115 @@ class MyDBModel:
             if msg_cnt > 0:
                 logging.info("Fleetbot: There are %d message to be sent!", msg_cnt)
 
-            duplicates = 0
-            # filter duplicates because fuck spam pings
-            for group in messages_by_group.keys():
-                msgs = messages_by_group[group]
+            # duplicates are filtered by the ping source, see fleetbot.mark_duplicates
+            return messages_by_group, max_id
+        return {}, last_id
 
-                last_msg = ""
 
-                for i in range(0, len(msgs)):
-                    if msgs[i]['message'] == last_msg:
-                        msgs[i]['forward'] = False
-                        duplicates += 1
 
-                    last_msg = msgs[i]['message']
+class AsyncDBModel:
+    """ Asynchronous version of MyDBModel: offers the same methods as coroutines,
+    which run the blocking pymysql calls in a bounded thread pool executor, so
+    a slow query does not block the discord.py event loop """
 
-            if duplicates > 0:
-                logging.info("Fleetbot: Found %d duplicates!", duplicates)
+    def __init__(self, model, max_workers=None):
+        self.model = model # the synchronous MyDBModel
+        # every worker thread checks out its own connection, so there is no
+        # point in having more workers than pooled connections
+        if max_workers is None:
+            max_workers = model.pool.max_size
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
 
-            return messages_by_group
-        return {}
+    def close(self):
+        """ stops the executor (pending queries are still finished) """
+        self.executor.shutdown(wait=False)
+
+    @asyncio.coroutine
+    def run(self, func, *args):
+        """ runs func(*args) in the executor and returns its result """
+        loop = asyncio.get_event_loop()
+        return (yield from loop.run_in_executor(self.executor, func, *args))
+
+    @asyncio.coroutine
+    def check_db_connection(self):
+        return (yield from self.run(self.model.check_db_connection))
+
+    @asyncio.coroutine
+    def set_discord_member_id_for_auth_code(self, auth_code, member_id):
+        return (yield from self.run(self.model.set_discord_member_id_for_auth_code, auth_code, member_id))
+
+    @asyncio.coroutine
+    def get_roles_for_member(self, member_id):
+        return (yield from self.run(self.model.get_roles_for_member, member_id))
+
+    @asyncio.coroutine
+    def get_roles_for_all_members(self):
+        return (yield from self.run(self.model.get_roles_for_all_members))
+
+    @asyncio.coroutine
+    def is_auth_code_in_table(self, auth_code):
+        return (yield from self.run(self.model.is_auth_code_in_table, auth_code))
+
+    @asyncio.coroutine
+    def get_discord_members_number_of_kills(self, member_id):
+        return (yield from self.run(self.model.get_discord_members_number_of_kills, member_id))
+
+    @asyncio.coroutine
+    def get_discord_members_character_id(self, member_id):
+        return (yield from self.run(self.model.get_discord_members_character_id, member_id))
+
+    @asyncio.coroutine
+    def get_all_authed_members(self):
+        return (yield from self.run(self.model.get_all_authed_members))
+
+    @asyncio.coroutine
+    def get_authed_members_since(self, since=None):
+        return (yield from self.run(self.model.get_authed_members_since, since))
+
+    @asyncio.coroutine
+    def delete_pending_auths(self):
+        return (yield from self.run(self.model.delete_pending_auths))
+
+    @asyncio.coroutine
+    def get_authed_member_ids(self):
+        return (yield from self.run(self.model.get_authed_member_ids))
+
+    @asyncio.coroutine
+    def get_authed_member(self, member_id):
+        return (yield from self.run(self.model.get_authed_member, member_id))
+
+    @asyncio.coroutine
+    def update_ping_start_stop_hour(self, discord_member_id, start_hour, stop_hour):
+        return (yield from self.run(self.model.update_ping_start_stop_hour, discord_member_id, start_hour, stop_hour))
+
+    @asyncio.coroutine
+    def get_fleetbot_max_message_id(self):
+        return (yield from self.run(self.model.get_fleetbot_max_message_id))
+
+    @asyncio.coroutine
+    def find_pos(self, solar_system_id=None):
+        return (yield from self.run(self.model.find_pos, solar_system_id))
+
+    @asyncio.coroutine
+    def get_all_solar_systems(self):
+        return (yield from self.run(self.model.get_all_solar_systems))
+
+    @asyncio.coroutine
+    def get_all_published_items(self):
+        return (yield from self.run(self.model.get_all_published_items))
+
+    @asyncio.coroutine
+    def get_all_prices(self):
+        return (yield from self.run(self.model.get_all_prices))
+
+    @asyncio.coroutine
+    def get_item_price(self, item_type_id):
+        return (yield from self.run(self.model.get_item_price, item_type_id))
+
+    @asyncio.coroutine
+    def get_expensive_killmails(self, last_id=0):
+        return (yield from self.run(self.model.get_expensive_killmails, last_id))
+
+    @asyncio.coroutine
+    def get_fleetbot_messages(self, last_id=0, limit=100):
+        return (yield from self.run(self.model.get_fleetbot_messages, last_id, limit))
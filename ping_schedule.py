@@ -0,0 +1,63 @@
+""" Ping windows of members (!pingme): which members get their time dependent
+roles (time_dependent_groups) at which hour """
+
+from datetime import datetime
+
+
+def is_in_ping_window(start_hour, stop_hour, hour):
+    """ returns True if hour (UTC) is within the ping window from start_hour to stop_hour """
+    # case 0: user does not care about any time dependency
+    if start_hour == 0 and stop_hour == 0:
+        return True
+    # case 1: start_hour < stop_hour, e.g., between 8 and 22 hours
+    if start_hour < stop_hour:
+        return start_hour <= hour < stop_hour
+    # case 2: start_hour > stop_hour, e.g., between 16 and 4 hours
+    if start_hour > stop_hour:
+        return hour >= start_hour or hour < stop_hour
+    return False
+
+
+class PingWindowSchedule:
+    """ Keeps the ping window of every member, and for each of the 24 hours the
+    members whose window opens or closes at the start of that hour, so that
+    only these members need to be checked when the hour changes """
+
+    def __init__(self):
+        self.windows = {} # member id -> (start hour, stop hour)
+        self.transitions = [set() for hour in range(24)] # hour -> member ids
+
+    def load(self, authed_users):
+        """ (re)builds the schedule from the authed users (see MyDBModel.get_all_authed_members) """
+        self.windows = {}
+        self.transitions = [set() for hour in range(24)]
+        for member_id, authed_user in authed_users.items():
+            self.set_window(member_id, authed_user['start_hour'], authed_user['stop_hour'])
+
+    def set_window(self, member_id, start_hour, stop_hour):
+        """ sets (or changes) the ping window of a member """
+        self.remove(member_id)
+        start_hour, stop_hour = int(start_hour), int(stop_hour)
+        self.windows[member_id] = (start_hour, stop_hour)
+        for hour in range(24):
+            if is_in_ping_window(start_hour, stop_hour, hour) != is_in_ping_window(start_hour, stop_hour, (hour - 1) % 24):
+                self.transitions[hour].add(member_id)
+
+    def remove(self, member_id):
+        """ forgets the ping window of a member """
+        window = self.windows.pop(member_id, None)
+        if window is not None:
+            for hour in range(24):
+                self.transitions[hour].discard(member_id)
+
+    def is_active(self, member_id, hour=None):
+        """ returns True if the member should have the time dependent roles at
+        hour (default: the current UTC hour); members without a window always do """
+        if hour is None:
+            hour = datetime.utcnow().hour
+        start_hour, stop_hour = self.windows.get(member_id, (0, 0))
+        return is_in_ping_window(start_hour, stop_hour, hour)
+
+    def transitions_at(self, hour):
+        """ returns the ids of the members whose ping window opens or closes at hour """
+        return set(self.transitions[hour])
@@ -0,0 +1,164 @@
+""" Dispatching of channel messages to bot commands """
+
+import asyncio
+import logging
+
+from scheduler import TokenBucket
+
+
+COMMAND_PREFIX = "!"
+
+
+def parse_command(content):
+    """ splits a message into command and parameters in one pass, returns
+    (cmd, params), or (None, "") if the message is not a command """
+    if not content.startswith(COMMAND_PREFIX):
+        return None, ""
+    parts = content.split(None, 1)
+    if len(parts) == 0:
+        return None, ""
+    return parts[0], parts[1] if len(parts) > 1 else ""
+
+
+class CommandRouter:
+    """ Maps command names (including aliases) to handlers, so a message is
+    dispatched with one dictionary lookup. Handlers are coroutine functions
+    handler(message, cmd, params). Admin commands are only dispatched if the
+    message was sent in an admin channel.
+
+    Regular commands run as tasks, at most max_concurrent at a time, so a slow
+    command does not hold up on_message. Each user and each channel has a
+    token bucket (user_limit and channel_limit commands per period seconds);
+    commands over the limit are dropped, and the user (or the channel, if the
+    channel is over its limit) is told to slow down once (via
+    send_func(channel, msg)) until the bucket has tokens again. """
+
+    SLOW_DOWN_MESSAGE = "<@{}> Slow down! I will ignore your commands for a couple of seconds."
+    CHANNEL_SLOW_DOWN_MESSAGE = "Too many commands in this channel! I will ignore commands here for a couple of seconds."
+
+    def __init__(self, send_func=None, max_concurrent=8, user_limit=5, channel_limit=15, period=10.0):
+        self.routes = {} # command name -> (handler, admin_only)
+
+        self.send_func = send_func
+        self.max_concurrent = max_concurrent
+        self.semaphore = None # created on first use, so it belongs to the running loop
+        self.tasks = set()
+
+        self.user_limit = (user_limit, period)
+        self.channel_limit = (channel_limit, period)
+        self.buckets = {} # ('user', id) or ('channel', id) -> TokenBucket
+        self.warned = set() # bucket keys which got their slow down message
+
+        # metrics
+        self.executed = 0
+        self.throttled = 0
+
+    def add(self, name, handler, aliases=(), admin_only=False):
+        """ registers handler for the command name and its aliases """
+        for cmd in [name] + list(aliases):
+            self.routes[cmd] = (handler, admin_only)
+
+    def clear(self, admin_only=False):
+        """ removes all regular commands (or all admin commands) """
+        for cmd in [cmd for cmd, route in self.routes.items() if route[1] == admin_only]:
+            del self.routes[cmd]
+
+    def commands(self):
+        """ returns the names of all regular commands """
+        return sorted([cmd for cmd, route in self.routes.items() if not route[1]])
+
+    @asyncio.coroutine
+    def dispatch(self, message, is_admin_channel=False):
+        """ dispatches message to its command handler, returns True if there was one """
+        content = message.content
+        # fast exit for the vast majority of messages
+        if not content.startswith(COMMAND_PREFIX):
+            return False
+
+        cmd, params = parse_command(content)
+        route = self.routes.get(cmd)
+        if route is None or (route[1] and not is_admin_channel):
+            logging.info("Command '%s' not found...", cmd)
+            return False
+
+        logging.info("Found command string '%s'", cmd)
+        handler, admin_only = route
+        if admin_only:
+            # admin commands run right away (e.g., !restart has to stop the bot)
+            yield from handler(message, cmd, params)
+            return True
+
+        if not self.allow(message):
+            self.throttled += 1
+            return False
+
+        task = asyncio.async(self.run(handler, message, cmd, params))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return True
+
+    def get_bucket(self, key, limit):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) > 1000:
+                # forget the buckets of everyone who has not used commands recently
+                for old_key in [k for k, b in self.buckets.items() if b.delay() == 0 and b.tokens >= b.limit]:
+                    del self.buckets[old_key]
+            bucket = TokenBucket(*limit)
+            self.buckets[key] = bucket
+        return bucket
+
+    def allow(self, message):
+        """ returns True if message is within the user and channel limits """
+        for key, limit in [(('user', message.author.id), self.user_limit),
+                           (('channel', message.channel.id), self.channel_limit)]:
+            bucket = self.get_bucket(key, limit)
+            if bucket.delay() > 0:
+                logging.info("CommandRouter: %s %s is over its command limit", key[0], key[1])
+                if key not in self.warned:
+                    self.warned.add(key)
+                    if self.send_func is not None:
+                        if key[0] == 'user':
+                            msg = self.SLOW_DOWN_MESSAGE.format(message.author.id)
+                        else:
+                            # do not blame whoever happened to send the next command
+                            msg = self.CHANNEL_SLOW_DOWN_MESSAGE
+                        asyncio.async(self.send_func(message.channel, msg))
+                return False
+
+        for key in [('user', message.author.id), ('channel', message.channel.id)]:
+            self.buckets[key].consume()
+            self.warned.discard(key)
+        return True
+
+    @asyncio.coroutine
+    def run(self, handler, message, cmd, params):
+        """ runs a command as soon as less than max_concurrent commands are running """
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrent)
+
+        yield from self.semaphore.acquire()
+        try:
+            self.executed += 1
+            yield from handler(message, cmd, params)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logging.exception("CommandRouter: command '%s' failed", cmd)
+        finally:
+            self.semaphore.release()
+
+    def stop(self):
+        """ cancels all running commands """
+        for task in list(self.tasks):
+            task.cancel()
+        self.tasks.clear()
+        self.semaphore = None
+
+    def metrics(self):
+        """ returns a dictionary with command statistics """
+        return {
+            'executed': self.executed,
+            'throttled': self.throttled,
+            'running': len(self.tasks)
+        }
@@ -23,15 +23,11 @@ import asyncio
 import logging
 import logging.handlers
 import time
-import websockets.exceptions
 
-import pymysql
-import pymysql.cursors
-import pymysql.connections
-
-import discord
-
-from  discordbot import MyDiscordBotClient
+# discord, websockets and pymysql take a while to import, they are imported
+# when they are needed (see connectToDB and startBot), so startup can be timed
+from startup import StartupTimer
+import autoresponder
 
 logging.basicConfig(level=logging.DEBUG, format="%(asctime)s [%(threadName)-12.12s] [%(levelname)-5.5s]  %(message)s")
 
@@ -59,14 +55,17 @@ class MyBotApp:
     def __init__(self):
         """ Initialize by parsing the commandline arguments and processing the
         config files """
+        self.startup_timer = StartupTimer()
         args = self.parseArguments()
         config = self.processConfigFiles(args)
+        self.startup_timer.mark("config")
 
 
-        self.db = None # type: pymysql.connections.Connection
+        self.db = None # type: ConnectionPool
         if self.connectToDB(args, config) == None:
             logging.info('Stopping...')
             return # could not connect to DB, exiting...
+        self.startup_timer.mark("database")
 
         # start bot, close with ctrl-c
         self.startBot(args, config, self.db)
@@ -77,11 +76,16 @@ class MyBotApp:
         """ destruct the app - disconnect from DB """
         logging.info("Stopping bot app")
         if self.db != None:
+            self.db.close()
             self.db = None
 
 
     def startBot(self, args, config, db):
         """ Run the client in a blocking call that logs in and runs the event loop, exists on Ctrl-C"""
+        import discord
+        import websockets.exceptions
+        from discordbot import MyDiscordBotClient
+        self.startup_timer.mark("imports")
 
         logging.info("Starting bot now (stop with CTRL-C)...")
 
@@ -99,7 +103,30 @@ class MyBotApp:
                                             config.get('Bot', 'time_dependent_groups'),
                                             config.get('Bot', 'fleetbot_channels'),
                                             config.get('Bot', 'post_expensive_killmails_to'),
-                                            run_verify_user_loop=True  # ToDo: set this to true
+                                            run_verify_user_loop=True,  # ToDo: set this to true
+                                            full_sweep_interval=config.getint('Bot', 'full_sweep_interval'),
+                                            db_poll_interval=config.getint('Bot', 'db_poll_interval'),
+                                            fleetbot_batch_size=config.getint('Bot', 'fleetbot_batch_size'),
+                                            fleetbot_ping_source=config.get('Bot', 'fleetbot_ping_source'),
+                                            fleetbot_poll_min_interval=config.getint('Bot', 'fleetbot_poll_min_interval'),
+                                            fleetbot_poll_max_interval=config.getint('Bot', 'fleetbot_poll_max_interval'),
+                                            price_refresh_interval=config.getint('Bot', 'price_refresh_interval'),
+                                            autoresponder_rules=autoresponder.load_rules(config),
+                                            command_max_concurrent=config.getint('Bot', 'command_max_concurrent'),
+                                            command_user_limit=config.getint('Bot', 'command_user_limit'),
+                                            command_channel_limit=config.getint('Bot', 'command_channel_limit'),
+                                            command_limit_period=config.getint('Bot', 'command_limit_period'),
+                                            debug_digest_interval=config.getint('Bot', 'debug_digest_interval'),
+                                            debug_digest_max_events=config.getint('Bot', 'debug_digest_max_events'),
+                                            auth_maintenance_interval=config.getint('Bot', 'auth_maintenance_interval'),
+                                            shard_index=config.getint('Bot', 'shard_index'),
+                                            shard_count=config.getint('Bot', 'shard_count'),
+                                            reconcile_workers=config.getint('Bot', 'reconcile_workers'),
+                                            snapshot_file=config.get('Bot', 'snapshot_file'),
+                                            snapshot_interval=config.getint('Bot', 'snapshot_interval'),
+                                            snapshot_max_age=config.getint('Bot', 'snapshot_max_age'),
+                                            snapshot_fleetbot_max_age=config.getint('Bot', 'snapshot_fleetbot_max_age'),
+                                            startup_timer=self.startup_timer
                                             )
                 logging.info("Calling client.run()")
                 # use run_until_complete manually, as described in client.run()
@@ -108,7 +135,7 @@ class MyBotApp:
                 # if this finished, the bot either crashed OR user pressed ctrl+c (caught by keyboardinterrupt)
 
                 logging.info("client.run() finished! Trying to stop additional loops")
-                client.stop_additional_loops()
+                client.stop_additional_loops(shutdown=True)
 
                 # in case we are continuing: get a new event loop
                 logging.info("getting a new event loop")
@@ -126,7 +153,11 @@ class MyBotApp:
             finally: # close client connection
                 logging.info("In finally: stopping loop etc...")
                 if client:
-                    client.stop_additional_loops()
+                    try:
+                        client.save_snapshot()
+                    except:
+                        logging.exception("Could not save snapshot")
+                    client.stop_additional_loops(shutdown=True)
                     client.loop.close()
 
             if not stop:
@@ -140,19 +171,26 @@ class MyBotApp:
 
     def connectToDB(self, args, config):
         """ connect to the database as specified in the config file
-        :return the database object
-        :rtype pymysql.connections.Connection
+        :return the database connection pool
+        :rtype ConnectionPool
         """
         if self.db == None:
+            import pymysql.cursors
+            from model import ConnectionPool
             # try connection to the database
             logging.debug("Connecting to database")
             try:
-                self.db = pymysql.connect(host=config.get('Database', 'dbhost'),
-                                             user=config.get('Database', 'dbuser'),
-                                             password=config.get('Database', 'dbpass'),
-                                             db=config.get('Database', 'dbname'),
-                                             charset='utf8mb4',
-                                             cursorclass=pymysql.cursors.DictCursor)
+                connect_kwargs = {'host': config.get('Database', 'dbhost'),
+                                  'user': config.get('Database', 'dbuser'),
+                                  'password': config.get('Database', 'dbpass'),
+                                  'db': config.get('Database', 'dbname'),
+                                  'charset': 'utf8mb4',
+                                  'cursorclass': pymysql.cursors.DictCursor}
+                self.db = ConnectionPool(connect_kwargs,
+                                         min_size=config.getint('Database', 'pool_min_size'),
+                                         max_size=config.getint('Database', 'pool_max_size'),
+                                         ping_interval=config.getint('Database', 'pool_ping_interval'),
+                                         max_lifetime=config.getint('Database', 'pool_max_lifetime'))
                 logging.info("Successfully connected to database")
                 return self.db
             except:
@@ -0,0 +1,261 @@
+""" Rate limit aware scheduler for outgoing discord API calls """
+
+import asyncio
+import heapq
+import itertools
+import logging
+import re
+import time
+
+
+# default limits (requests, seconds) until discord tells us better via the
+# X-RateLimit-* headers, by the first part of the route
+DEFAULT_ROUTE_LIMITS = {
+    'channels': (5, 5.0),   # messages per channel
+    'guilds': (10, 10.0),   # member (role) updates per server
+    'users': (5, 5.0)       # direct messages per user
+}
+
+DEFAULT_GLOBAL_LIMIT = (50, 1.0)
+
+# priorities of outgoing calls (lower is more important)
+PRIORITY_FLEET = 0   # fleetbot pings
+PRIORITY_AUTH = 1    # auth replies and requests to auth
+PRIORITY_ROLES = 2   # role updates
+PRIORITY_DEBUG = 3   # debug channel and notifications (e.g., killmails)
+PRIORITY_FUN = 4     # replies to commands
+DEFAULT_PRIORITY = PRIORITY_FUN
+
+# matches the major parameter of an API url, e.g. /api/v6/channels/1234/messages
+ROUTE_URL_REGEX = re.compile(r"/api/v\d+/(channels|guilds|users)/(\d+)(?:/([a-z_]+))?")
+
+
+def route_from_url(url):
+    """ returns the route key (e.g., channels/1234/messages) of an API url or None """
+    match = ROUTE_URL_REGEX.search(str(url))
+    if match is None:
+        return None
+    return "/".join([part for part in match.groups() if part])
+
+
+class TokenBucket:
+    """ A token bucket which allows limit calls per period seconds """
+
+    def __init__(self, limit, period):
+        self.limit = limit
+        self.period = period
+        self.tokens = float(limit)
+        self.updated = time.time()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(float(self.limit), self.tokens + elapsed * self.limit / self.period)
+            self.updated = now
+
+    def delay(self, now=None):
+        """ returns the number of seconds until a token is available (0 if one is available now) """
+        if now is None:
+            now = time.time()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        if self.tokens >= 1.0:
+            return 0.0
+        return (1.0 - self.tokens) * self.period / self.limit
+
+    def consume(self):
+        self.tokens -= 1.0
+
+    def block(self, seconds):
+        """ no tokens are handed out for the next seconds """
+        self.tokens = 0.0
+        self.updated = time.time()
+        self.blocked_until = max(self.blocked_until, self.updated + seconds)
+
+    def update_from_headers(self, headers):
+        """ adapts the bucket to the X-RateLimit-* headers of a discord response """
+        try:
+            limit = headers.get('X-RateLimit-Limit')
+            remaining = headers.get('X-RateLimit-Remaining')
+            reset = headers.get('X-RateLimit-Reset')
+            if limit is not None:
+                self.limit = max(int(limit), 1)
+            if remaining is not None:
+                self.tokens = min(float(remaining), float(self.limit))
+                self.updated = time.time()
+                if int(remaining) == 0 and reset is not None:
+                    # reset is an epoch timestamp; never trust it for longer than one period
+                    self.block(min(max(float(reset) - time.time(), 0.0), self.period))
+        except (TypeError, ValueError):
+            logging.debug("TokenBucket: could not parse rate limit headers %s", str(headers))
+
+
+class OutboundScheduler:
+    """ Every outgoing discord API call (send_message, add_roles, ...) goes through
+    this scheduler, which waits for a token of the per-route bucket and of the
+    global bucket before the call is made. Buckets start with DEFAULT_ROUTE_LIMITS
+    and are updated from the rate limit headers of discord's responses (see
+    observe_response), so calls are sent as fast as discord allows.
+
+    Calls which have to wait are queued by priority (PRIORITY_FLEET first,
+    PRIORITY_FUN last) and, within a priority, in order; whenever tokens become
+    available they are handed to the most important waiting call. """
+
+    def __init__(self, route_limits=None, global_limit=DEFAULT_GLOBAL_LIMIT):
+        self.route_limits = route_limits if route_limits is not None else DEFAULT_ROUTE_LIMITS
+        self.global_bucket = TokenBucket(*global_limit)
+        self.buckets = {}
+
+        self.waiters = [] # heap of (priority, sequence number, route, future)
+        self.sequence = itertools.count()
+        self.dispatcher = None
+        self.wakeup = None
+
+        # metrics
+        self.calls = 0
+        self.delayed_calls = 0
+        self.total_delay = 0.0
+        self.rate_limited = 0
+        self.delay_by_priority = {} # priority -> (delayed calls, total delay)
+
+    def get_bucket(self, route):
+        """ returns the bucket for a route (creates it if needed) """
+        bucket = self.buckets.get(route)
+        if bucket is None:
+            limit, period = self.route_limits.get(route.split("/")[0], DEFAULT_GLOBAL_LIMIT)
+            bucket = TokenBucket(limit, period)
+            self.buckets[route] = bucket
+        return bucket
+
+    @asyncio.coroutine
+    def acquire(self, route, priority=DEFAULT_PRIORITY):
+        """ waits until a call on route may be made """
+        bucket = self.get_bucket(route)
+        self.calls += 1
+
+        # fast path: nobody is waiting and there are tokens
+        if len(self.waiters) == 0 and bucket.delay() <= 0 and self.global_bucket.delay() <= 0:
+            bucket.consume()
+            self.global_bucket.consume()
+            return
+
+        start = time.time()
+        future = asyncio.Future()
+        heapq.heappush(self.waiters, (priority, next(self.sequence), route, future))
+        if self.dispatcher is None or self.dispatcher.done():
+            self.wakeup = asyncio.Event()
+            self.dispatcher = asyncio.async(self.dispatch())
+        else:
+            self.wakeup.set()
+        yield from future
+
+        waited = time.time() - start
+        self.delayed_calls += 1
+        self.total_delay += waited
+        count, total = self.delay_by_priority.get(priority, (0, 0.0))
+        self.delay_by_priority[priority] = (count + 1, total + waited)
+
+    @asyncio.coroutine
+    def dispatch(self):
+        """ hands out tokens to the waiting calls, most important first """
+        while len(self.waiters) > 0:
+            now = time.time()
+            next_wait = None
+            remaining = []
+            blocked_routes = set()
+            for entry in sorted(self.waiters):
+                priority, sequence, route, future = entry
+                if future.done(): # the waiting call got cancelled
+                    continue
+                if route in blocked_routes:
+                    # keeps calls on the same route in order
+                    remaining.append(entry)
+                    continue
+
+                bucket = self.get_bucket(route)
+                wait = max(bucket.delay(now), self.global_bucket.delay(now))
+                if wait <= 0:
+                    bucket.consume()
+                    self.global_bucket.consume()
+                    future.set_result(None)
+                else:
+                    remaining.append(entry)
+                    blocked_routes.add(route)
+                    next_wait = wait if next_wait is None else min(next_wait, wait)
+
+            self.waiters = remaining # sorted, so it is a valid heap
+            if len(self.waiters) > 0:
+                # sleep until the next token is available, or until a new call arrives
+                self.wakeup.clear()
+                try:
+                    yield from asyncio.wait_for(self.wakeup.wait(), next_wait)
+                except asyncio.TimeoutError:
+                    pass
+
+    @asyncio.coroutine
+    def call(self, route, func, *args, priority=DEFAULT_PRIORITY, **kwargs):
+        """ calls the coroutine function func(*args, **kwargs) as soon as the rate limits allow it """
+        yield from self.acquire(route, priority)
+        return (yield from func(*args, **kwargs))
+
+    def stop(self):
+        """ drops all waiting calls, e.g. before the event loop is replaced """
+        if self.dispatcher is not None:
+            self.dispatcher.cancel()
+            self.dispatcher = None
+        for priority, sequence, route, future in self.waiters:
+            future.cancel()
+        self.waiters = []
+
+    def observe_response(self, method, url, status, headers):
+        """ feeds the headers of a discord API response into the buckets """
+        route = route_from_url(url)
+        if route is not None:
+            self.get_bucket(route).update_from_headers(headers)
+
+        if status == 429:
+            self.rate_limited += 1
+            try:
+                # discord sends retry after in milliseconds
+                retry_after = float(headers.get('Retry-After', 1000)) / 1000.0
+            except ValueError:
+                retry_after = 1.0
+            if headers.get('X-RateLimit-Global', '').lower() == 'true':
+                logging.info("OutboundScheduler: globally rate limited for %.2f seconds", retry_after)
+                self.global_bucket.block(retry_after)
+            elif route is not None:
+                logging.info("OutboundScheduler: rate limited on %s for %.2f seconds", route, retry_after)
+                self.get_bucket(route).block(retry_after)
+
+    def metrics(self):
+        """ returns a dictionary with scheduler statistics """
+        return {
+            'calls': self.calls,
+            'delayed_calls': self.delayed_calls,
+            'avg_delay_ms': round(1000.0 * self.total_delay / self.delayed_calls, 2) if self.delayed_calls > 0 else 0.0,
+            'rate_limited': self.rate_limited,
+            'routes': len(self.buckets),
+            'queued': len(self.waiters),
+            'avg_delay_ms_by_priority': dict([(priority, round(1000.0 * total / count, 2))
+                                              for priority, (count, total) in self.delay_by_priority.items()])
+        }
+
+
+class RateLimitObservingSession:
+    """ Wraps the aiohttp session of discord.HTTPClient and reports the headers of
+    every response to an OutboundScheduler (discord.py does not expose them) """
+
+    def __init__(self, session, scheduler):
+        self._session = session
+        self._scheduler = scheduler
+
+    @asyncio.coroutine
+    def request(self, method, url, **kwargs):
+        response = yield from self._session.request(method, url, **kwargs)
+        self._scheduler.observe_response(method, url, response.status, response.headers)
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
@@ -0,0 +1,115 @@
+""" Partitioning of role reconciliation: members are assigned to bot instances
+(shard_index of shard_count) and, within an instance, to concurrent workers
+by a stable hash of their id """
+
+import asyncio
+import logging
+import time
+import zlib
+
+
+def member_hash(member_id):
+    """ a hash of member_id which is the same in every process (unlike hash()) """
+    return zlib.crc32(str(member_id).encode())
+
+
+class ShardProgress:
+    """ Progress of one worker during a sweep """
+
+    def __init__(self, worker):
+        self.worker = worker
+        self.members = 0        # members in this shard during the last sweep
+        self.checked = 0        # members checked so far in the current/last sweep
+        self.changed = 0        # members whose roles were changed
+        self.errors = 0
+        self.started_at = 0.0
+        self.finished_at = 0.0
+        self.last_duration = 0.0
+
+    def metrics(self):
+        now = time.time()
+        running = self.started_at > self.finished_at
+        return {
+            'members': self.members,
+            'checked': self.checked,
+            'changed': self.changed,
+            'errors': self.errors,
+            'running': running,
+            'last_duration_s': round(self.last_duration, 1),
+            # time since this shard was last fully reconciled
+            'lag_s': int(now - self.finished_at) if self.finished_at > 0 else -1
+        }
+
+
+class ShardCoordinator:
+    """ Decides which members this bot instance reconciles (shard_index of
+    shard_count instances; all instances read the same desired roles from the
+    database) and runs sweeps with worker_count concurrent workers, each
+    reconciling its own partition of the members. Only the primary instance
+    (shard_index 0) answers messages and runs the other loops.
+    The workers are coroutines in the same process and all role changes go
+    through the rate limit of the one OutboundScheduler, so more workers only
+    overlap the waits for the database and discord, they do not send faster;
+    add shards (instances) for that. """
+
+    def __init__(self, shard_index=0, shard_count=1, worker_count=1):
+        if shard_count < 1 or not 0 <= shard_index < shard_count:
+            raise ValueError("Invalid shard {} of {}".format(shard_index, shard_count))
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.worker_count = max(1, worker_count)
+        self.progress = [ShardProgress(worker) for worker in range(self.worker_count)]
+
+    def is_primary(self):
+        return self.shard_index == 0
+
+    def owns(self, member_id):
+        """ returns True if this instance reconciles member_id """
+        return member_hash(member_id) % self.shard_count == self.shard_index
+
+    def worker_of(self, member_id):
+        return (member_hash(member_id) // self.shard_count) % self.worker_count
+
+    def partition(self, member_ids):
+        """ splits the member ids owned by this instance into one list per worker """
+        partitions = [[] for worker in range(self.worker_count)]
+        for member_id in member_ids:
+            if self.owns(member_id):
+                partitions[self.worker_of(member_id)].append(member_id)
+        return partitions
+
+    @asyncio.coroutine
+    def run_sweep(self, member_ids, verify_func):
+        """ reconciles the owned members of member_ids, calling the coroutine
+        function verify_func(member_id) (which returns True if it changed the
+        member's roles) from worker_count concurrent workers """
+        start = time.time()
+        partitions = self.partition(member_ids)
+        yield from asyncio.gather(*[self.run_worker(self.progress[worker], partitions[worker], verify_func)
+                                    for worker in range(self.worker_count)])
+        logging.info("ShardCoordinator: shard %d/%d reconciled %d members in %.2f seconds",
+                     self.shard_index, self.shard_count, sum([len(p) for p in partitions]), time.time() - start)
+
+    @asyncio.coroutine
+    def run_worker(self, progress, member_ids, verify_func):
+        progress.members = len(member_ids)
+        progress.checked = 0
+        progress.changed = 0
+        progress.errors = 0
+        progress.started_at = time.time()
+        for member_id in member_ids:
+            try:
+                if (yield from verify_func(member_id)):
+                    progress.changed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                progress.errors += 1
+                logging.exception("ShardCoordinator: worker %d could not verify member %s", progress.worker, member_id)
+            progress.checked += 1
+        progress.finished_at = time.time()
+        progress.last_duration = progress.finished_at - progress.started_at
+
+    def metrics(self):
+        """ returns the progress of every worker, by worker number """
+        return dict([(progress.worker, progress.metrics()) for progress in self.progress])
@@ -0,0 +1,53 @@
+""" Saves the state of the bot (authed users, roles, forwarder watermarks, ...)
+to a compressed local file, so a restart does not start from scratch """
+
+import gzip
+import json
+import logging
+import os
+import time
+
+
+SNAPSHOT_VERSION = 2
+
+
+def serialize_snapshot(state):
+    """ returns state (a json serializable dictionary) as compressed snapshot data """
+    state = dict(state)
+    state['version'] = SNAPSHOT_VERSION
+    state['saved_at'] = time.time()
+    return gzip.compress(json.dumps(state, separators=(',', ':')).encode())
+
+
+def write_snapshot(path, data):
+    """ writes snapshot data (see serialize_snapshot) to path; the old snapshot is
+    replaced only once the new one is complete """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path, max_age):
+    """ returns the state stored in the snapshot at path, or None if there is no
+    snapshot, it is older than max_age seconds, or it can not be read """
+    if not os.path.isfile(path):
+        logging.info("No snapshot found at %s", path)
+        return None
+    try:
+        with open(path, "rb") as f:
+            state = json.loads(gzip.decompress(f.read()).decode())
+    except (OSError, ValueError):
+        logging.exception("Could not read snapshot %s", path)
+        return None
+
+    if state.get('version') != SNAPSHOT_VERSION:
+        logging.info("Ignoring snapshot %s with version %s", path, state.get('version'))
+        return None
+    age = time.time() - state.get('saved_at', 0)
+    if age > max_age:
+        logging.info("Ignoring snapshot %s, it is %d seconds old", path, age)
+        return None
+
+    logging.info("Loaded snapshot %s (%d seconds old)", path, age)
+    return state
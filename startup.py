@@ -0,0 +1,35 @@
+""" Measures how long the bot takes from starting the process until it is ready """
+
+import time
+
+
+class StartupTimer:
+    """ Records named steps of the startup (mark(name) at the end of each step)
+    and reports how long each of them took """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.last_mark = self.started_at
+        self.steps = [] # list of (step name, duration in seconds)
+        self.reported = False
+
+    def mark(self, name):
+        """ ends the step name, the next step starts now """
+        now = time.time()
+        self.steps.append((name, now - self.last_mark))
+        self.last_mark = now
+
+    def total(self):
+        """ returns the seconds since the timer was created """
+        return self.last_mark - self.started_at
+
+    def report(self):
+        """ returns the durations of all steps as one line, e.g., for the log """
+        steps = ", ".join(["{}={}ms".format(name, int(duration * 1000)) for name, duration in self.steps])
+        return "Ready after {:.2f} seconds ({})".format(self.total(), steps)
+
+    def metrics(self):
+        """ returns the duration of every step in milliseconds, and the total """
+        metrics = dict([(name, int(duration * 1000)) for name, duration in self.steps])
+        metrics['total'] = int(self.total() * 1000)
+        return metrics
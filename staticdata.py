@@ -0,0 +1,362 @@
+""" In-memory index of the EVE static data (solar systems and items), so that
+!system, !item and !pos lookups do not have to query MySQL """
+
+import asyncio
+import bisect
+import heapq
+import itertools
+import logging
+import time
+import unicodedata
+from collections import Counter
+
+
+def fold(text):
+    """ lower case text without accents, e.g. Ragnarök -> ragnarok """
+    text = unicodedata.normalize('NFKD', text.lower())
+    return "".join([c for c in text if not unicodedata.combining(c)])
+
+
+def trigrams(text):
+    """ returns the set of 3-character substrings of text """
+    return set([text[i:i + 3] for i in range(len(text) - 2)])
+
+
+def padded_trigrams(text):
+    """ trigrams of text with padding, so short words and word starts have trigrams as well """
+    return trigrams("  " + text + " ")
+
+
+def edit_distance(a, b, max_distance):
+    """ returns the optimal string alignment distance (levenshtein plus
+    transpositions of two adjacent characters) between a and b, or
+    max_distance + 1 if it is larger than max_distance """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    if a == b:
+        return 0
+
+    # only the cells within max_distance of the diagonal can be small enough
+    too_far = max_distance + 1
+    previous2 = None
+    previous = [j if j <= max_distance else too_far for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        current = [too_far] * (len(b) + 1)
+        if i <= max_distance:
+            current[0] = i
+        row_min = current[0]
+        char = a[i - 1]
+        previous_char = a[i - 2] if i > 1 else None
+        for j in range(max(1, i - max_distance), min(len(b), i + max_distance) + 1):
+            # substitution (or match), deletion, insertion, transposition
+            value = previous[j - 1] if char == b[j - 1] else previous[j - 1] + 1
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            if j > 1 and char == b[j - 2] and previous_char == b[j - 1] and previous2[j - 2] + 1 < value:
+                value = previous2[j - 2] + 1
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > max_distance:
+            return too_far
+        previous2, previous = previous, current
+    return min(previous[len(b)], too_far)
+
+
+class FuzzyNameIndex:
+    """ An index over a sorted list of names: substring lookups via trigrams, and
+    a typo tolerant search. The search looks up every word of the query in the
+    vocabulary of all names (the word itself, or the words within a few typos
+    of it, found via a trigram index of the vocabulary), takes the names
+    containing a match of every word as candidates and ranks them by edit
+    distance. Names sharing rare trigrams with the query are the candidates if
+    no word matches. """
+
+    # number of candidates that are ranked by edit distance
+    MAX_CANDIDATES = 20
+    # number of vocabulary words (by trigram overlap) compared with a query word
+    MAX_WORD_CANDIDATES = 20
+    # trigrams found in more names than this are skipped when looking for
+    # candidates by trigrams (they hardly narrow it down, but take long to count)
+    MAX_POSTINGS = 1000
+    # substring candidates are checked directly once there are this few of them
+    MAX_VERIFY = 64
+
+    def __init__(self, names):
+        self.keys = [fold(name) for name in names]
+        self.postings = {} # trigram -> set of indices into self.keys
+        self.words = {} # word -> set of indices into self.keys
+        for idx, key in enumerate(self.keys):
+            for trigram in padded_trigrams(key):
+                if trigram not in self.postings:
+                    self.postings[trigram] = set()
+                self.postings[trigram].add(idx)
+            for word in key.split():
+                if word not in self.words:
+                    self.words[word] = set()
+                self.words[word].add(idx)
+
+        # the names containing a word, shortest first
+        self.word_names = {}
+        self.word_postings = {} # trigram -> set of words
+        for word, indices in self.words.items():
+            self.word_names[word] = sorted(indices, key=lambda idx: len(self.keys[idx]))
+            for trigram in padded_trigrams(word):
+                if trigram not in self.word_postings:
+                    self.word_postings[trigram] = set()
+                self.word_postings[trigram].add(word)
+
+    def prefix(self, text):
+        """ returns the indices of all keys starting with text (keys must be sorted) """
+        text = fold(text)
+        indices = []
+        idx = bisect.bisect_left(self.keys, text)
+        while idx < len(self.keys) and self.keys[idx].startswith(text):
+            indices.append(idx)
+            idx += 1
+        return indices
+
+    def substring(self, text, limit=None):
+        """ returns the (sorted) indices of all keys which contain text, or the
+        first limit of them """
+        needle = fold(text)
+        if len(needle) < 3:
+            # too short for the trigram index, scan all keys
+            matches = (idx for idx, key in enumerate(self.keys) if needle in key)
+            return list(itertools.islice(matches, limit))
+
+        postings = []
+        for trigram in trigrams(needle):
+            if trigram not in self.postings:
+                return []
+            postings.append(self.postings[trigram])
+
+        # the two rarest trigrams narrow the candidates down most, checking the
+        # remaining candidates directly is faster than intersecting more postings
+        postings.sort(key=len)
+        candidates = postings[0]
+        if len(candidates) > self.MAX_VERIFY and len(postings) > 1:
+            candidates = candidates & postings[1]
+
+        matches = (idx for idx in sorted(candidates) if needle in self.keys[idx])
+        return list(itertools.islice(matches, limit))
+
+    def exact(self, text):
+        """ returns the index of the key equal to text, or None """
+        text = fold(text)
+        idx = bisect.bisect_left(self.keys, text)
+        if idx < len(self.keys) and self.keys[idx] == text:
+            return idx
+        return None
+
+    def close_words(self, word):
+        """ returns the words of the vocabulary within a few typos of word (just
+        word if it is in the vocabulary); for short words (where one typo
+        destroys most trigrams) the variants of word with two adjacent
+        characters swapped are used to find them as well """
+        if word in self.words:
+            return [word]
+        max_distance = max(1, len(word) // 4)
+        variants = [word]
+        if len(word) <= 10:
+            variants += [word[:i] + word[i + 1] + word[i] + word[i + 2:] for i in range(len(word) - 1)]
+
+        overlap = Counter()
+        for trigram in set().union(*[padded_trigrams(variant) for variant in variants]):
+            overlap.update(self.word_postings.get(trigram, ()))
+
+        matches = []
+        for candidate, count in overlap.most_common(self.MAX_WORD_CANDIDATES):
+            distance = edit_distance(word, candidate, max_distance)
+            if distance <= max_distance:
+                matches.append((distance, candidate))
+        return [candidate for distance, candidate in sorted(matches)]
+
+    def candidates(self, query, word_matches=None):
+        """ returns the indices of the keys which contain a close match (see
+        close_words, or word_matches: the close words of every word of query)
+        of every word of query, shortest first """
+        if word_matches is None:
+            word_matches = [self.close_words(word) for word in query.split()]
+        # words without any match do not rule out names, the edit distance decides
+        word_matches = [matches for matches in word_matches if len(matches) > 0]
+        if len(word_matches) == 0:
+            return self.trigram_candidates(query)
+
+        if len(word_matches) == 1:
+            indices = set()
+            for word in word_matches[0]:
+                indices.update(self.word_names[word][:self.MAX_CANDIDATES])
+        else:
+            # names containing a match of every word, rarest word first
+            word_indices = [set().union(*[self.words[word] for word in matches]) for matches in word_matches]
+            word_indices.sort(key=len)
+            indices = word_indices[0]
+            for other_indices in word_indices[1:]:
+                indices = indices & other_indices
+
+        return heapq.nsmallest(self.MAX_CANDIDATES, indices, key=lambda idx: abs(len(self.keys[idx]) - len(query)))
+
+    def trigram_candidates(self, query):
+        """ returns the indices of the keys which share the most (not too common)
+        trigrams with query """
+        overlap = Counter()
+        for trigram in padded_trigrams(query):
+            postings = self.postings.get(trigram, ())
+            if len(postings) <= self.MAX_POSTINGS:
+                overlap.update(postings)
+
+        return [idx for idx, count in overlap.most_common(self.MAX_CANDIDATES)]
+
+    def search(self, text, limit=5):
+        """ typo tolerant search, returns up to limit (score, index) tuples with
+        the best match first; score is 1.0 for an exact match """
+        query = fold(text)
+        if len(query.split()) == 0:
+            # e.g., only whitespace
+            return []
+        # allow one typo per four characters
+        max_distance = max(1, len(query) // 4)
+        word_matches = [self.close_words(word) for word in query.split()]
+        query_words = len(word_matches)
+        # parts of names only need to be compared if they start with a match of the first word
+        first_words = set(word_matches[0]) if len(word_matches[0]) > 0 else None
+
+        results = []
+        part_distances = {} # many names share words, compare each of them only once
+        for idx in self.candidates(query, word_matches):
+            key = self.keys[idx]
+
+            # the query may be just a part of the name, e.g. "hokbill" for "caldari navy hookbill"
+            part, part_distance = None, max_distance + 1
+            words = key.split()
+            for i in range(len(words) - query_words + 1):
+                if first_words is not None and words[i] not in first_words:
+                    continue
+                window = " ".join(words[i:i + query_words])
+                window_distance = part_distances.get(window)
+                if window_distance is None:
+                    window_distance = edit_distance(query, window, max_distance)
+                    part_distances[window] = window_distance
+                if window_distance < part_distance:
+                    part, part_distance = window, window_distance
+
+            # a match of the full name ranks higher than an equally close partial one
+            distance = edit_distance(query, key, min(max_distance, part_distance))
+            if distance <= part_distance and distance <= max_distance:
+                results.append((1.0 - float(distance) / max(len(query), len(key)), idx))
+            elif part_distance <= max_distance:
+                results.append((0.9 * (1.0 - float(part_distance) / max(len(query), len(part))), idx))
+
+        results.sort(key=lambda result: (-result[0], result[1]))
+        return results[:limit]
+
+
+class StaticDataIndex:
+    """ Holds all solar systems and all published items in memory. The data only
+    changes with game patches; it is loaded once on startup and can be reloaded
+    with !reload_staticdata. find_system matches the start of a system name and
+    find_item matches a part of an item name; both fall back to a typo tolerant
+    search (search_systems, search_items) if nothing matches. """
+
+    # a typo tolerant match is only taken as the answer if it scores at least this
+    # much, weaker matches are listed as suggestions
+    MIN_MATCH_SCORE = 0.75
+
+    def __init__(self, model):
+        self.model = model
+        self.loaded = False
+        self.load_lock = None
+
+        self.systems = []      # sorted by name
+        self.system_index = FuzzyNameIndex([])
+        self.items = []        # sorted by name
+        self.item_index = FuzzyNameIndex([])
+
+    @asyncio.coroutine
+    def load(self):
+        """ (re)loads the static data from the database """
+        if self.load_lock is None:
+            self.load_lock = asyncio.Lock()
+
+        yield from self.load_lock.acquire()
+        try:
+            start = time.time()
+            systems = yield from self.model.get_all_solar_systems()
+            items = yield from self.model.get_all_published_items()
+
+            # building the index takes a moment, do not block the event loop with it
+            loop = asyncio.get_event_loop()
+            systems, system_index, items, item_index = yield from loop.run_in_executor(None, self.build, systems, items)
+            # swap everything at once on the event loop, lookups never see a half built index
+            self.systems, self.system_index = systems, system_index
+            self.items, self.item_index = items, item_index
+            self.loaded = True
+            logging.info("StaticDataIndex: loaded %d systems and %d items in %.2f seconds",
+                         len(self.systems), len(self.items), time.time() - start)
+        finally:
+            self.load_lock.release()
+
+    @asyncio.coroutine
+    def ensure_loaded(self):
+        """ loads the static data if that has not happened yet """
+        if not self.loaded:
+            yield from self.load()
+
+    def build(self, systems, items):
+        """ builds the index from lists of system and item dictionaries (see
+        MyDBModel.get_all_solar_systems and MyDBModel.get_all_published_items),
+        returns (systems, system index, items, item index); runs in a thread,
+        so it must not change self """
+        systems = sorted(systems, key=lambda system: fold(system['solarSystemName']))
+        system_index = FuzzyNameIndex([system['solarSystemName'] for system in systems])
+
+        items = sorted(items, key=lambda item: fold(item['name']))
+        item_index = FuzzyNameIndex([item['name'] for item in items])
+        return systems, system_index, items, item_index
+
+    def search_systems(self, system_str, limit=5):
+        """ typo tolerant search, returns a list of (score, system dict) """
+        return [(score, self.systems[idx]) for score, idx in self.system_index.search(system_str, limit)]
+
+    def search_items(self, item_str, limit=5):
+        """ typo tolerant search, returns a list of (score, item dict) """
+        return [(score, self.items[idx]) for score, idx in self.item_index.search(item_str, limit)]
+
+    def find_system(self, system_str, limit=5):
+        """ Returns a system and region name based on system_str (prefix, or the
+        best matches of a typo tolerant search if no system starts with it) """
+        systems = [self.systems[idx] for idx in self.system_index.prefix(system_str)]
+        if len(systems) == 1:
+            return dict(systems[0])
+        if len(systems) == 0:
+            results = self.search_systems(system_str, limit)
+            if len(results) == 1 and results[0][0] >= self.MIN_MATCH_SCORE:
+                return dict(results[0][1])
+            systems = [system for score, system in results]
+
+        if len(systems) == 0:
+            return None
+        return [system['solarSystemName'] + " (" + system['regionName'] + ")" for system in systems]
+
+    def find_item(self, item_str, limit=5):
+        """ Returns info about item (exact name, substring, or the best matches
+        of a typo tolerant search if no item name contains item_str) """
+        idx = self.item_index.exact(item_str)
+        if idx is not None:
+            return dict(self.items[idx])
+
+        indices = self.item_index.substring(item_str, limit)
+        if len(indices) == 1:
+            return dict(self.items[indices[0]])
+        if len(indices) == 0:
+            results = self.item_index.search(item_str, limit)
+            if len(results) == 1 and results[0][0] >= self.MIN_MATCH_SCORE:
+                return dict(self.items[results[0][1]])
+            indices = [idx for score, idx in results]
+
+        if len(indices) == 0:
+            return None
+        return [self.items[idx]['name'] for idx in indices]
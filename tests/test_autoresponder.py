@@ -0,0 +1,47 @@
+""" Tests for autoresponder.AutoResponder (run with python -m unittest) """
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from autoresponder import AutoResponseRule, AutoResponder
+
+
+class OverlappingRulesTest(unittest.TestCase):
+    """ a rule whose keyword overlaps the keyword of an earlier rule ("I LOVE"
+    and "LOVE") must still respond when the earlier rule does not """
+
+    def test_earlier_rule_in_other_channel(self):
+        responder = AutoResponder([
+            AutoResponseRule("ilove", ["A"], keywords=["I LOVE"], channels=["general"]),
+            AutoResponseRule("love", ["B"], keywords=["LOVE"])
+        ])
+        self.assertEqual(responder.get_response("general", "I love it"), "A")
+        self.assertEqual(responder.get_response("offtopic", "I love it"), "B")
+
+    def test_earlier_rule_cooling_down(self):
+        responder = AutoResponder([
+            AutoResponseRule("ilove", ["A"], keywords=["I LOVE"], cooldown=30),
+            AutoResponseRule("love", ["B"], keywords=["LOVE"])
+        ])
+        self.assertEqual(responder.get_response("general", "I love it"), "A")
+        self.assertEqual(responder.get_response("general", "I love it"), "B")
+
+    def test_config_order_wins(self):
+        responder = AutoResponder([
+            AutoResponseRule("loveit", ["A"], keywords=["LOVE IT"]),
+            AutoResponseRule("ilove", ["B"], keywords=["I LOVE"])
+        ])
+        self.assertEqual(responder.get_response("general", "I love it"), "A")
+
+    def test_no_match(self):
+        responder = AutoResponder([
+            AutoResponseRule("ilove", ["A"], keywords=["I LOVE"])
+        ])
+        self.assertIsNone(responder.get_response("general", "I hate it"))
+
+
+if __name__ == '__main__':
+    unittest.main()
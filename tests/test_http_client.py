@@ -0,0 +1,135 @@
+""" Tests for http_client.AsyncHTTPClient against a local stub server (run with python -m unittest) """
+
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+try:
+    import aiohttp
+    from http_client import AsyncHTTPClient, HTTPClientError
+except ImportError:
+    aiohttp = None
+
+
+class StubHTTPProtocol(asyncio.Protocol):
+    """ Minimal keep-alive HTTP/1.1 server for GET requests, answers according to
+    the path of the request:
+    /ok: 200, /missing: 404, /error: always 500, /flaky: 500 on the first request, then 200,
+    /slow: never answers """
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.buffer = b""
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.connections += 1
+
+    def data_received(self, data):
+        self.buffer += data
+        while b"\r\n\r\n" in self.buffer:
+            request, self.buffer = self.buffer.split(b"\r\n\r\n", 1)
+            path = request.split(b"\r\n", 1)[0].split(b" ")[1].decode().split("?")[0]
+            self.handle(path)
+
+    def handle(self, path):
+        self.server.hits[path] = self.server.hits.get(path, 0) + 1
+        if path == "/slow":
+            return
+        if path == "/ok" or (path == "/flaky" and self.server.hits[path] > 1):
+            status = "200 OK"
+        elif path == "/missing":
+            status = "404 Not Found"
+        else:
+            status = "500 Internal Server Error"
+        body = b'{"path": "' + path.encode() + b'"}'
+        self.transport.write("HTTP/1.1 {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n"
+                             "Connection: keep-alive\r\n\r\n".format(status, len(body)).encode() + body)
+
+
+class StubHTTPServer:
+    """ Runs StubHTTPProtocol on a free local port and counts requests per path and connections """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.hits = {}
+        self.connections = 0
+        self.server = loop.run_until_complete(
+            loop.create_server(lambda: StubHTTPProtocol(self), "127.0.0.1", 0))
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    def url(self, path):
+        return "http://127.0.0.1:{}{}".format(self.port, path)
+
+    def close(self):
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+
+
+@unittest.skipIf(aiohttp is None, "aiohttp is not installed")
+class AsyncHTTPClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.server = StubHTTPServer(self.loop)
+        self.client = AsyncHTTPClient(loop=self.loop, timeout=0.5, retries=2, retry_delay=0.01)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def run_coro(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_ok(self):
+        self.assertEqual(self.run_coro(self.client.get_json(self.server.url("/ok"))), {'path': "/ok"})
+        self.assertEqual(self.client.metrics()['retried'], 0)
+
+    def test_timeout_is_retried(self):
+        with self.assertRaises(HTTPClientError):
+            self.run_coro(self.client.get(self.server.url("/slow")))
+        self.assertEqual(self.server.hits["/slow"], 3)
+        self.assertEqual(self.client.metrics()['failed'], 1)
+
+    def test_retry_on_5xx(self):
+        status, final_url, body = self.run_coro(self.client.get(self.server.url("/flaky")))
+        self.assertEqual(status, 200)
+        self.assertEqual(self.server.hits["/flaky"], 2)
+        self.assertEqual(self.client.metrics()['retried'], 1)
+
+    def test_5xx_fails_after_all_retries(self):
+        with self.assertRaises(HTTPClientError):
+            self.run_coro(self.client.get(self.server.url("/error")))
+        self.assertEqual(self.server.hits["/error"], 3)
+
+    def test_no_retry_on_4xx(self):
+        with self.assertRaises(HTTPClientError):
+            self.run_coro(self.client.get(self.server.url("/missing")))
+        self.assertEqual(self.server.hits["/missing"], 1)
+        self.assertEqual(self.client.metrics()['retried'], 0)
+
+    def test_session_reused_and_recreated_after_close(self):
+        self.run_coro(self.client.get(self.server.url("/ok")))
+        session = self.client.session
+        self.run_coro(self.client.get(self.server.url("/ok")))
+        # both requests went over the same keep-alive connection
+        self.assertIs(self.client.session, session)
+        self.assertEqual(self.server.connections, 1)
+
+        self.client.close()
+        self.assertIsNone(self.client.session)
+        self.run_coro(self.client.get(self.server.url("/ok")))
+        self.assertIsNot(self.client.session, session)
+        self.assertEqual(self.server.hits["/ok"], 3)
+        self.assertEqual(self.server.connections, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()